@@ -0,0 +1,166 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+'''
+local SQLite store of bug statuses
+'''
+
+import json
+import os
+import sqlite3
+import time
+
+from lib import debsoap
+from lib import utils
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS bugs (
+    id INTEGER PRIMARY KEY,
+    package TEXT,
+    source TEXT,
+    severity TEXT,
+    last_modified INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bugs_package ON bugs (package);
+CREATE INDEX IF NOT EXISTS bugs_source ON bugs (source);
+CREATE INDEX IF NOT EXISTS bugs_severity ON bugs (severity);
+CREATE TABLE IF NOT EXISTS bug_tags (
+    bug INTEGER NOT NULL REFERENCES bugs (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (bug, tag)
+);
+CREATE INDEX IF NOT EXISTS bug_tags_tag ON bug_tags (tag);
+CREATE TABLE IF NOT EXISTS selections (
+    selection TEXT PRIMARY KEY,
+    synced INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS selection_bugs (
+    selection TEXT NOT NULL REFERENCES selections (selection) ON DELETE CASCADE,
+    bug INTEGER NOT NULL,
+    PRIMARY KEY (selection, bug)
+);
+CREATE TABLE IF NOT EXISTS seen (
+    bug INTEGER PRIMARY KEY,
+    msg_num INTEGER NOT NULL,
+    last_modified INTEGER
+);
+'''
+
+class NotSyncedError(LookupError):
+    pass
+
+def get_default_path():
+    return utils.get_cache_dir('bugs.sqlite')
+
+def selection_key(query):
+    '''
+    canonical representation of the query (as accepted by debsoap.Client.query_bugs())
+    '''
+    return json.dumps(query, sort_keys=True)
+
+class Store:
+
+    def __init__(self, path=None):
+        if path is None:
+            path = get_default_path()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.executescript(_schema)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._db.commit()
+        self.close()
+
+    def commit(self):
+        self._db.commit()
+
+    def get_last_modified(self):
+        '''
+        return {bug number: last_modified timestamp} for all stored bugs
+        '''
+        return dict(self._db.execute('SELECT id, last_modified FROM bugs'))
+
+    def put(self, bug):
+        data = bug.as_dict()
+        self._db.execute(
+            'INSERT OR REPLACE INTO bugs (id, package, source, severity, last_modified, data) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (bug.id, bug.package, bug.source, bug.severity, data['last_modified'], json.dumps(data))
+        )
+        self._db.execute('DELETE FROM bug_tags WHERE bug = ?', (bug.id,))
+        self._db.executemany(
+            'INSERT OR IGNORE INTO bug_tags (bug, tag) VALUES (?, ?)',
+            ((bug.id, tag) for tag in bug.tags)
+        )
+
+    def set_selection(self, query, bug_numbers):
+        key = selection_key(query)
+        self._db.execute('DELETE FROM selections WHERE selection = ?', (key,))
+        self._db.execute(
+            'INSERT INTO selections (selection, synced) VALUES (?, ?)',
+            (key, int(time.time()))
+        )
+        self._db.executemany(
+            'INSERT OR IGNORE INTO selection_bugs (selection, bug) VALUES (?, ?)',
+            ((key, n) for n in bug_numbers)
+        )
+
+    def get_selection(self, query):
+        '''
+        return numbers of bugs matching the query, as of the last sync
+        '''
+        key = selection_key(query)
+        [[n]] = self._db.execute('SELECT COUNT(*) FROM selections WHERE selection = ?', (key,))
+        if not n:
+            raise NotSyncedError(query)
+        return [n for [n] in self._db.execute('SELECT bug FROM selection_bugs WHERE selection = ?', (key,))]
+
+    def get_seen(self, bugno):
+        '''
+        return (highest message number displayed, last_modified timestamp at that time),
+        or None if the bug has never been displayed
+        '''
+        return self._db.execute('SELECT msg_num, last_modified FROM seen WHERE bug = ?', (bugno,)).fetchone()
+
+    def set_seen(self, bug, msg_num):
+        last_modified = bug.as_dict()['last_modified']
+        self._db.execute(
+            'INSERT OR REPLACE INTO seen (bug, msg_num, last_modified) VALUES (?, ?, ?)',
+            (bug.id, msg_num, last_modified)
+        )
+
+    def get_bugs(self, *queries, reverse=False):
+        '''
+        yield stored BugStatus objects for bugs matching any of the queries,
+        in ascending (or, if reverse is true, descending) bug number order
+        '''
+        bug_numbers = set()
+        for query in queries:
+            if isinstance(query, int):
+                bug_numbers.add(query)
+            else:
+                bug_numbers.update(self.get_selection(query))
+        for n in sorted(bug_numbers, reverse=reverse):
+            row = self._db.execute('SELECT data FROM bugs WHERE id = ?', (n,)).fetchone()
+            if row is None:
+                raise NotSyncedError(n)
+            [data] = row
+            yield debsoap.BugStatus.from_dict(json.loads(data))
+
+__all__ = [
+    'NotSyncedError',
+    'Store',
+    'get_default_path',
+    'selection_key',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -7,25 +7,66 @@ command-line interface
 
 import argparse
 import importlib
+import sys
 
+from lib import httpcache
 from lib import pager
 from lib import utils
 from lib import web
 
 def xmain():
     ap = argparse.ArgumentParser()
+    ap.add_argument('--debug', action='store_true', help='print debugging information to stderr')
+    ap.add_argument('--offline', action='store_true', help='use only cached responses')
+    ap.add_argument('--no-cache', dest='cache', action='store_false', help='do not use the HTTP cache')
+    ap.add_argument('--cache-ttl', metavar='SECONDS', type=int, default=0,
+        help='for how long to use cached SOAP responses (default: %(default)s, i.e. only with --offline)'
+    )
+    ap.add_argument('-j', '--jobs', metavar='N', type=int, default=4,
+        help='maximum number of concurrent requests (default: %(default)s)'
+    )
+    ap.add_argument('--batch-size', metavar='N', type=int, default=500,
+        help='maximum number of bugs per status request (default: %(default)s)'
+    )
+    ap.add_argument('--batch-time', metavar='SECONDS', type=float, default=2.0,
+        help='target duration of a status request; slower requests make batches smaller (default: %(default)s)'
+    )
     sp = ap.add_subparsers()
     sp.dest = 'cmd'  # https://bugs.python.org/issue9253
     sp.required = True
-    for cmd in ['ls', 'show', 'new']:
+    for cmd in ['ls', 'show', 'new', 'sync', 'attachments']:
         mod = importlib.import_module(f'lib.cmd.{cmd}')
         mod.add_argument_parser(sp)
     options = ap.parse_args()
-    options.session = web.UserAgent()
+    utils.debug_enabled = options.debug
+    if options.offline and not options.cache:
+        ap.error('--offline requires the cache')
+    if options.jobs < 1:
+        ap.error('--jobs must be positive')
+    if options.batch_size < 1:
+        ap.error('--batch-size must be positive')
+    if options.batch_time <= 0:
+        ap.error('--batch-time must be positive')
+    cache = None
+    if options.cache:
+        cache = httpcache.Cache(utils.get_cache_dir('http'))
+    options.session = web.UserAgent(
+        cache=cache,
+        offline=options.offline,
+        post_ttl=options.cache_ttl,
+    )
     mod = importlib.import_module(f'lib.cmd.{options.cmd}')
     options.error = ap.error
-    with pager.autopager():
-        mod.run(options)
+    try:
+        with pager.autopager():
+            mod.run(options)
+    except web.OfflineError as exc:
+        print(f'{ap.prog}: error: {exc}', file=sys.stderr)
+        sys.exit(1)
+    finally:
+        options.session.close()
+        stats = options.session.stats
+        utils.debug(f'HTTP connections: {stats["opened"]} opened, {stats["reused"]} reused')
 
 def main():
     try:
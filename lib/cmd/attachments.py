@@ -0,0 +1,113 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+'the “attachments” command'
+
+import concurrent.futures
+import os
+import re
+import shutil
+
+from lib import colorterm
+from lib import deblogic
+from lib.cmd import show
+
+def add_argument_parser(subparsers):
+    ap = subparsers.add_parser('attachments')
+    ap.add_argument('bug', metavar='BUGSPEC',
+        help='bug number or URL, optionally pointing to a particular message'
+    )
+    ap.add_argument('--msg', metavar='N', type=int, action='append',
+        help='download only attachments of message N (can be used multiple times)'
+    )
+    ap.add_argument('-o', '--output-dir', metavar='DIR', default='.',
+        help='save attachments in DIR (default: current directory)'
+    )
+    return ap
+
+def get_file_name(msgno, i, name):
+    '''
+    return file name for i-th attachment of message msgno;
+    it's prefixed with the message and attachment numbers, because bugs
+    (and even single messages) often have many attachments with the same name
+    (e.g. build logs)
+    '''
+    if name is not None:
+        name = os.path.basename(name)
+        name = re.sub(r'[\x00-\x1F\x7F]', '_', name)
+        name = name.lstrip('.')
+    if not name:
+        return f'{msgno}-{i}'
+    return f'{msgno}-{i}-{name}'
+
+def download(url, path, *, session):
+    '''
+    download url to path, unless the file already exists and has the same size;
+    return True if the file was downloaded
+    '''
+    # Ask for the exact file contents,
+    # so that Content-Length can be compared with the local file size.
+    headers = {'Accept-Encoding': 'identity'}
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        pass
+    else:
+        size = session.head(url, headers=headers).get('Content-Length')
+        if size is not None and st.st_size == int(size):
+            return False
+    tmp_path = path + '.part'
+    with session.get_stream(url, headers=headers, cache=False) as fp:
+        try:
+            with open(tmp_path, 'wb') as file:
+                shutil.copyfileobj(fp, file)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+    os.replace(tmp_path, path)
+    return True
+
+def run(options):
+    try:
+        (bugno, msgno) = deblogic.parse_msgspec(options.bug)
+    except ValueError:
+        options.error(f'{options.bug!r} is not a valid bug number')
+    msgs = set(options.msg or ())
+    if msgno is not None:
+        msgs.add(msgno)
+    html = show.fetch_html(bugno, session=options.session)
+    attachments = show.extract_attachments(html)
+    downloads = []
+    for msgno, msg_attachments in sorted(attachments.items()):
+        if msgs and msgno not in msgs:
+            continue
+        for i, (name, url, tp) in enumerate(msg_attachments, start=1):
+            path = os.path.join(options.output_dir, get_file_name(msgno, i, name))
+            downloads += [(path, url)]
+    if not downloads:
+        return
+    os.makedirs(options.output_dir, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=options.jobs) as executor:
+        futures = [
+            executor.submit(download, url, path, session=options.session)
+            for path, url in downloads
+        ]
+        try:
+            for (path, url), future in zip(downloads, futures):
+                if future.result():
+                    colorterm.print('{path}', path=path)
+                else:
+                    colorterm.print('{path} {t.bold}(skipped){t.off}', path=path)
+        finally:
+            for future in futures:
+                future.cancel()
+
+__all__ = [
+    'add_argument_parser',
+    'run',
+]
+
+# vim:ts=4 sts=4 sw=4 et
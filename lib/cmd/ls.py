@@ -3,24 +3,62 @@
 
 'the “ls” command'
 
+import contextlib
+import csv
 import functools
+import itertools
+import json
 import os
 import re
+import sys
 
+from lib import bugstore
 from lib import colorterm
 from lib import deblogic
 from lib import debsoap
+from lib import srcindex
 from lib import utils
 
 def add_argument_parser(subparsers):
     ap = subparsers.add_parser('ls')
     ap.add_argument('selections', metavar='SELECTION', type=str, nargs='+')
+    ap.add_argument('--local', action='store_true', help='use only the local bug store (see the "sync" command)')
+    ap.add_argument('--unsorted', action='store_true',
+        help='print bugs in no particular order, as soon as they are downloaded'
+    )
+    ap.add_argument('--limit', metavar='N', type=int,
+        help='print at most N bugs; with the default ordering, the newest ones'
+    )
+    ap.add_argument('--count', action='store_true', help='print only the number of matching bugs')
+    ap.add_argument('--severity', metavar='SEVERITY', action='append', choices=deblogic.severities,
+        help='select only bugs with this severity (can be used multiple times)'
+    )
+    ap.add_argument('--tag', metavar='TAG', action='append',
+        help='select only bugs with this tag (can be used multiple times)'
+    )
+    group = ap.add_mutually_exclusive_group()
+    group.add_argument('--open', action='store_true', help='select only bugs that are not done')
+    group.add_argument('--done', action='store_true', help='select only bugs that are done')
+    ap.add_argument('--archived', action='store_true', help='select archived bugs instead of unarchived ones')
+    ap.add_argument('--format', choices=['text', 'jsonl', 'tsv', 'csv'], default='text',
+        help='output format (default: %(default)s)'
+    )
+    ap.add_argument('--fields', metavar='FIELD[,FIELD...]',
+        help='fields to include in the jsonl/tsv/csv output (default: all); '
+        'available fields: ' + str.join(', ', debsoap.BugStatus.field_names)
+    )
     return ap
 
 class SourcePackageLookupError(RuntimeError):
     pass
 
 def select_sources_for(pkgname):
+    sources = srcindex.get_sources(pkgname)
+    if sources is not None:
+        if not sources:
+            raise SourcePackageLookupError(pkgname)
+        return [{'src': src} for src in sources]
+    # no package lists; fall back to python-apt
     @functools.lru_cache(maxsize=None)
     def get_cache():
         import apt
@@ -72,8 +110,7 @@ def strip_package_prefix(subject, package):
     regexp = fr'\A{re.escape(package)}(?:[:]\s*|\s+)'
     return re.sub(regexp, '', subject)
 
-def run(options):
-    debsoap_client = debsoap.Client(session=options.session)
+def parse_selections(options):
     queries = []
     for selection in options.selections:
         bugno = None
@@ -114,97 +151,271 @@ def run(options):
             queries += [dict(package=selection)]
         else:
             options.error(f'{selection!r} is not a valid package name')
-    bugs = debsoap_client.get_bugs(*queries)
-    bugs = sorted(bugs, key=(lambda bug: -bug.id))
-    for bug in bugs:
-        package = bug.package
-        subject = bug.subject or ''
-        default_severity = 'normal'
-        if package == 'wnpp':
-            for wnpp_tag in deblogic.wnpp_tags:
-                if subject.startswith(wnpp_tag + ': '):
-                    if wnpp_tag[-1] == 'P':
-                        default_severity = 'wishlist'
-                    package = None
-                    break
-        elif package == 'sponsorship-requests':
-            if subject.startswith('RFS:'):
+    return queries
+
+def print_bug(bug):
+    package = bug.package
+    subject = bug.subject or ''
+    default_severity = 'normal'
+    if package == 'wnpp':
+        for wnpp_tag in deblogic.wnpp_tags:
+            if subject.startswith(wnpp_tag + ': '):
+                if wnpp_tag[-1] == 'P':
+                    default_severity = 'wishlist'
                 package = None
-        template = ''
-        source = None
-        subject_color = '{t.green}' if bug.done else '{t.bold}'
-        if package is not None:
-            if package.startswith('src:'):
-                source = package[4:]
-                new_subject = strip_package_prefix(subject, source)
-                if subject != new_subject:
-                    subject = new_subject
-                    template += '[src:' + subject_color + '{src}{t.off}] '
-                else:
-                    template += '[src:{src}] '
+                break
+    elif package == 'sponsorship-requests':
+        if subject.startswith('RFS:'):
+            package = None
+    template = ''
+    source = None
+    subject_color = '{t.green}' if bug.done else '{t.bold}'
+    if package is not None:
+        if package.startswith('src:'):
+            source = package[4:]
+            new_subject = strip_package_prefix(subject, source)
+            if subject != new_subject:
+                subject = new_subject
+                template += '[src:' + subject_color + '{src}{t.off}] '
             else:
-                new_subject = strip_package_prefix(subject, package)
-                if subject != new_subject:
-                    subject = new_subject
-                    template += '[' + subject_color + '{pkg}{t.off}] '
-                else:
-                    template += '[{pkg}] '
-        if subject:
-            template += subject_color + '{subject}{t.off}'
+                template += '[src:{src}] '
         else:
-            template += '{t.red}(no subject){t.off}'
-        colorterm.print(template,
-            pkg=package,
-            src=source,
-            subject=subject,
+            new_subject = strip_package_prefix(subject, package)
+            if subject != new_subject:
+                subject = new_subject
+                template += '[' + subject_color + '{pkg}{t.off}] '
+            else:
+                template += '[{pkg}] '
+    if subject:
+        template += subject_color + '{subject}{t.off}'
+    else:
+        template += '{t.red}(no subject){t.off}'
+    colorterm.print(template,
+        pkg=package,
+        src=source,
+        subject=subject,
+    )
+    indent = '  '
+    template = indent + '{t.cyan}https://bugs.debian.org/{n}{t.off}'
+    if bug.forwarded:
+        template += ' -> {t.cyan}{forwarded}{t.off}'
+    colorterm.print(template, n=bug.id, forwarded=bug.forwarded)
+    template = indent + '{user}; {date}-00:00'
+    user = bug.submitter
+    if package == 'wnpp' and bug.owner is not None:
+        user = bug.owner
+    colorterm.print(template,
+        user=user,
+        date=bug.date,
+    )
+    template = ''
+    if bug.severity != default_severity:
+        severity_color = (
+            '{t.bold}{t.red}' if bug.severity in deblogic.rc_severities
+            else ''
         )
-        indent = '  '
-        template = indent + '{t.cyan}https://bugs.debian.org/{n}{t.off}'
-        if bug.forwarded:
-            template += ' -> {t.cyan}{forwarded}{t.off}'
-        colorterm.print(template, n=bug.id, forwarded=bug.forwarded)
-        template = indent + '{user}; {date}-00:00'
-        user = bug.submitter
-        if package == 'wnpp' and bug.owner is not None:
-            user = bug.owner
+        template = severity_color + '{severity}{t.off}'
+    if bug.tags:
+        if template:
+            template += ' '
+        template += '{tags}'
+    if template:
+        template = indent + template
         colorterm.print(template,
-            user=user,
-            date=bug.date,
+            tags=str.join(' ', ('+' + t for t in bug.tags)),
+            severity=bug.severity,
         )
-        template = ''
-        if bug.severity != default_severity:
-            severity_color = (
-                '{t.bold}{t.red}' if bug.severity in deblogic.rc_severities
-                else ''
-            )
-            template = severity_color + '{severity}{t.off}'
-        if bug.tags:
-            if template:
-                template += ' '
-            template += '{tags}'
-        if template:
-            template = indent + template
-            colorterm.print(template,
-                tags=str.join(' ', ('+' + t for t in bug.tags)),
-                severity=bug.severity,
-            )
-        template = ''
-        if bug.found_versions:
-            template = 'found in {found}'
-        if bug.fixed_versions:
-            if template:
-                template += '; '
-            template += 'fixed in {fixed}'
+    template = ''
+    if bug.found_versions:
+        template = 'found in {found}'
+    if bug.fixed_versions:
         if template:
-            template = indent + template
-            colorterm.print(template,
-                found=str.join(', ', bug.found_versions),
-                fixed=str.join(', ', bug.fixed_versions),
+            template += '; '
+        template += 'fixed in {fixed}'
+    if template:
+        template = indent + template
+        colorterm.print(template,
+            found=str.join(', ', bug.found_versions),
+            fixed=str.join(', ', bug.fixed_versions),
+        )
+    colorterm.print()
+
+def _format_field(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, list):
+        return str.join(' ', map(str, value))
+    return str(value)
+
+_tsv_blanks = str.maketrans('\t\n\r', '   ')
+
+def get_record_printer(fmt, fields, file=None):
+    '''
+    return function that prints the bug as a jsonl/tsv/csv record
+    '''
+    if file is None:
+        file = sys.stdout
+    write = file.write
+    if fmt == 'jsonl':
+        def print_record(bug):
+            d = bug.as_dict()
+            d = {field: d[field] for field in fields}
+            write(json.dumps(d, ensure_ascii=False) + '\n')
+    elif fmt == 'tsv':
+        write(str.join('\t', fields) + '\n')
+        def print_record(bug):
+            d = bug.as_dict()
+            # TSV has no escaping mechanism:
+            record = (
+                _format_field(d[field]).translate(_tsv_blanks)
+                for field in fields
             )
-        print()
+            write(str.join('\t', record) + '\n')
+    elif fmt == 'csv':
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(fields)
+        def print_record(bug):
+            d = bug.as_dict()
+            writer.writerow([_format_field(d[field]) for field in fields])
+    else:
+        raise ValueError(f'unsupported format: {fmt!r}')
+    return print_record
+
+def parse_fields(s):
+    '''
+    parse comma-separated list of BugStatus field names
+    '''
+    fields = s.split(',')
+    for field in fields:
+        if field not in debsoap.BugStatus.field_names:
+            raise ValueError(f'{field!r} is not a valid field')
+    return fields
+
+def get_filter(options, *, explicit=None):
+    '''
+    return predicate for BugStatus objects, or None if all the bugs should be selected;
+    explicit: if not None, numbers of explicitly listed bugs;
+    --archived is then checked only for these bugs,
+    because the other ones are selected as archived by the server
+    '''
+    predicates = []
+    if options.severity:
+        severities = set(options.severity)
+        predicates += [lambda bug: bug.severity in severities]
+    if options.tag:
+        tags = set(options.tag)
+        predicates += [lambda bug: tags.issubset(bug.tags)]
+    if options.open:
+        predicates += [lambda bug: not bug.done]
+    if options.done:
+        predicates += [lambda bug: bool(bug.done)]
+    if options.archived:
+        if explicit is None:
+            predicates += [lambda bug: bug.archived]
+        elif explicit:
+            predicates += [lambda bug: bug.archived or bug.id not in explicit]
+    if not predicates:
+        return
+    if len(predicates) == 1:
+        [predicate] = predicates
+        return predicate
+    return lambda bug: all(p(bug) for p in predicates)
+
+def run(options):
+    if options.limit is not None and options.limit < 1:
+        options.error('--limit must be positive')
+    if options.fields is None:
+        fields = debsoap.BugStatus.field_names
+    else:
+        if options.format == 'text':
+            options.error('--fields requires --format=jsonl, --format=tsv or --format=csv')
+        try:
+            fields = parse_fields(options.fields)
+        except ValueError as exc:
+            options.error(str(exc))
+    queries = parse_selections(options)
+    if options.local:
+        predicate = get_filter(options)
+    else:
+        explicit = {query for query in queries if isinstance(query, int)}
+        if any(isinstance(query, dict) and 'newest' in query for query in queries):
+            # the server can't select archived bugs among the newest ones
+            explicit = None
+        predicate = get_filter(options, explicit=explicit)
+    if options.archived and not options.local:
+        queries = [
+            dict(query, archive='1') if isinstance(query, dict) and 'newest' not in query
+            else query
+            for query in queries
+        ]
+    if options.local:
+        with bugstore.Store() as store:
+            try:
+                bugs = list(store.get_bugs(*queries, reverse=True))
+            except bugstore.NotSyncedError as exc:
+                [query] = exc.args
+                if isinstance(query, int):
+                    query = f'bug #{query}'
+                else:
+                    query = str.join(', ', (f'{k}:{v}' for k, v in query.items()))
+                options.error(f'{query} is not in the local bug store; run "dbts sync" first')
+        show_bugs(bugs, predicate=predicate, fields=fields, options=options)
+    else:
+        batch_size = options.batch_size
+        if options.limit is not None and predicate is None:
+            # nothing is filtered out, so the first batch is enough
+            batch_size = min(batch_size, options.limit)
+        debsoap_client = debsoap.Client(
+            session=options.session,
+            max_workers=options.jobs,
+            batch_size=batch_size,
+            batch_time=options.batch_time,
+        )
+        if options.count and predicate is None:
+            # the bug numbers are enough
+            n = len(debsoap_client.get_bug_numbers(*queries))
+            if options.limit is not None:
+                n = min(n, options.limit)
+            print(n)
+            return
+        # Bugs are printed as soon as they arrive;
+        # in the sorted mode, the newest ones come first.
+        bugs = debsoap_client.get_bugs(*queries,
+            pipelined=options.unsorted,
+            ordered=(not options.unsorted),
+        )
+        # pending status requests are cancelled when the generator is closed
+        with contextlib.closing(bugs):
+            show_bugs(bugs, predicate=predicate, fields=fields, options=options)
+
+def show_bugs(bugs, *, predicate, fields, options):
+    if predicate is not None:
+        bugs = filter(predicate, bugs)
+    if options.limit is not None:
+        # Stop fetching statuses as soon as enough bugs have been printed.
+        bugs = itertools.islice(bugs, options.limit)
+    if options.count:
+        print(sum(1 for bug in bugs))
+        return
+    if options.format == 'text':
+        for bug in bugs:
+            with colorterm.buffered():
+                print_bug(bug)
+    else:
+        # no colors, no quoting
+        print_record = get_record_printer(options.format, fields)
+        for bug in bugs:
+            print_record(bug)
 
 __all__ = [
     'add_argument_parser',
+    'get_filter',
+    'get_record_printer',
+    'parse_fields',
+    'parse_selections',
+    'print_bug',
     'run'
 ]
 
@@ -11,6 +11,7 @@ import subprocess
 import urllib.parse
 
 from lib import deblogic
+from lib import srcindex
 from lib import utils
 
 def add_argument_parser(subparsers):
@@ -186,7 +187,14 @@ def run(options):
         try:
             info = utils.xcmd('dpkg-query', '-Wf', '${Package}\x1F${Source}\x1F${Architecture}\x1F${Version}\x1F${Pre-Depends}\x1F${Depends}\x1F${Recommends}\x1F${Suggests}\n', package)
         except subprocess.CalledProcessError:
-            pass
+            if look_for_source:
+                # not installed; look it up in the APT package lists
+                sources = srcindex.get_sources(package)
+                if sources and len(sources) > 1:
+                    options.error(f'ambiguous source package for {package!r}: ' + str.join(', ', sources))
+                elif sources:
+                    [source] = sources
+                    package = None
         else:
             info = info.decode('ASCII')
             info = info.splitlines()
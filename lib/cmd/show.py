@@ -4,19 +4,27 @@
 'the “show” command'
 
 import collections
+import concurrent.futures
+import contextlib
 import email.header
+import email.parser
+import email.policy
 import email.utils
 import re
+import sqlite3
 import sys
 import urllib.parse
 
 import lxml.html
 
+from lib import bugstore
 from lib import colorterm
 from lib import deblogic
 from lib import debsoap
-from lib import dotparser
+from lib import httpcache
 from lib import indent
+from lib import utils
+from lib import versiongraph
 
 def print_version_graph(graph, *, ilevel=0):
     vcolors = dict(
@@ -47,15 +55,12 @@ def print_version_graph(graph, *, ilevel=0):
     s = indent.indent(s, ilevel)
     print(s)
 
-def extract_bug_version_graph(html, *, options):
+def extract_version_graph_url(html):
     version_urls = html.xpath('//div[@class="versiongraph"]/a/@href')
     if not version_urls:
         return
     [version_url] = version_urls
-    version_url += ';dot=1'
-    response = options.session.get(version_url)
-    response = response.decode('ASCII')
-    return dotparser.parse(response)
+    return version_url
 
 def extract_maintainers(html):
     for elem in html.xpath('//div[@class="pkginfo"]//a'):
@@ -91,19 +96,279 @@ def decode_header(s):
 
 def add_argument_parser(subparsers):
     ap = subparsers.add_parser('show')
-    ap.add_argument('bugs', metavar='BUGSPEC', nargs='+')
+    ap.add_argument('bugs', metavar='BUGSPEC', nargs='+',
+        help='bug number or URL, optionally pointing to a particular message'
+    )
     ap.add_argument('--merged', action='store_true', help='show also merged bugs')
+    ap.add_argument('--fast', action='store_true',
+        help='use only the SOAP interface; skip maintainers, attachments and control messages'
+    )
+    ap.add_argument('--new', action='store_true',
+        help='show only messages that have not been displayed by previous runs with --new'
+    )
+    ap.add_argument('--since', metavar='MSGNUM', type=int,
+        help='show only messages with numbers greater than MSGNUM'
+    )
+    group = ap.add_mutually_exclusive_group()
+    group.add_argument('--msg', metavar='N', type=int, action='append',
+        help='show only message N (can be used multiple times)'
+    )
+    group.add_argument('--last', metavar='N', type=int,
+        help='show only the last N messages'
+    )
+    ap.add_argument('--changelog', metavar='FILE',
+        help='compute version graphs from FILE (e.g. debian/changelog) when possible'
+    )
+    ap.add_argument('--prefetch', metavar='N', type=int, default=2,
+        help='download data for up to N following bugs in the background (default: %(default)s)'
+    )
     return ap
 
+def get_msg_filters(specs, msgs=()):
+    '''
+    merge (bug number, message number or None) pairs;
+    return {bug number: set of message numbers to show, or None for all messages},
+    in the order in which the bugs were first given;
+    msgs are message numbers to show for every bug
+    '''
+    filters = collections.OrderedDict()
+    for bugno, msgno in specs:
+        if msgno is None:
+            filters[bugno] = None
+        elif bugno not in filters:
+            filters[bugno] = {msgno}
+        elif filters[bugno] is not None:
+            filters[bugno].add(msgno)
+    if msgs:
+        for bugno, msg_filter in filters.items():
+            filters[bugno] = set(msgs).union(msg_filter or ())
+    return filters
+
 def run(options):
-    bugs = []
+    specs = []
     for bugspec in options.bugs:
         try:
-            bugs += [deblogic.parse_bugspec(bugspec)]
+            specs += [deblogic.parse_msgspec(bugspec)]
         except ValueError:
             options.error(f'{bugspec!r} is not a valid bug number')
-    for bugno in bugs:
-        run_one(bugno, options=options)
+    msg_filters = get_msg_filters(specs, options.msg)
+    bugs = list(msg_filters)
+    if options.prefetch < 0:
+        options.error('--prefetch must not be negative')
+    if options.last is not None and options.last < 1:
+        options.error('--last must be positive')
+    if options.last is not None and any(f is not None for f in msg_filters.values()):
+        options.error('--last cannot be used with message numbers')
+    with contextlib.ExitStack() as stack:
+        # the store is needed only to remember which messages have been seen
+        store = None
+        if options.new:
+            store = stack.enter_context(bugstore.Store())
+        executor = stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(max_workers=options.jobs)
+        )
+        # Log producers block until their logs are read,
+        # so they must not occupy the --jobs workers:
+        # other tasks of the bug being shown could be stuck behind them.
+        # There is at most one producer for each bug in the window.
+        log_executor = stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(max_workers=(options.prefetch + 1))
+        )
+        options.store = store
+        options.executor = executor
+        options.log_executor = log_executor
+        graph_cache = None
+        if options.cache:
+            graph_cache = httpcache.Cache(utils.get_cache_dir('version-graph'), max_size=(8 << 20))
+        # bugs of the same package often have the same version graph:
+        options.version_graphs = versiongraph.Cache(
+            session=options.session,
+            cache=graph_cache,
+            changelog=options.changelog,
+        )
+        options.debsoap_client = debsoap.Client(session=options.session, max_workers=options.jobs)
+        # fetch all the statuses at once:
+        statuses = get_statuses(bugs, options=options)
+        if options.merged:
+            merged_bugs = [
+                mbug
+                for bugno in bugs
+                for mbug in statuses[bugno].merged_with
+            ]
+            statuses.update(get_statuses(merged_bugs, known=statuses, options=options))
+            bugs = [
+                bugno
+                for obugno in bugs
+                for bugno in [obugno, *statuses[obugno].merged_with]
+            ]
+            for bugno in merged_bugs:
+                msg_filters.setdefault(bugno, set(options.msg) if options.msg else None)
+        # fetch everything else for the next few bugs in the background,
+        # while the current one is being printed:
+        bugs = iter(bugs)
+        window = collections.deque()
+        try:
+            while True:
+                for bugno in bugs:
+                    status = statuses[bugno]
+                    since = options.since
+                    unchanged = False
+                    if options.new:
+                        seen = store.get_seen(bugno)
+                        if seen is not None:
+                            (seen_msg_num, seen_last_modified) = seen
+                            since = max(since or 0, seen_msg_num)
+                            unchanged = seen_last_modified == status.as_dict()['last_modified']
+                    window.append(BugData(bugno,
+                        status=status,
+                        msgs=(sorted(msg_filters[bugno]) if msg_filters[bugno] is not None else None),
+                        since=since,
+                        unchanged=unchanged,
+                        options=options,
+                    ))
+                    if len(window) > options.prefetch:
+                        break
+                if not window:
+                    break
+                data = window.popleft()
+                try:
+                    show_bug(data, options=options)
+                finally:
+                    # stop the log download if the bug was not shown completely
+                    data.cancel()
+        finally:
+            for data in window:
+                data.cancel()
+    if graph_cache is not None:
+        graph_cache.prune()
+
+def get_statuses(bugs, *, known=(), options):
+    bugs = set(bugs).difference(known)
+    return {
+        status.id: status
+        for status in options.debsoap_client.get_bugs(*bugs)
+    }
+
+def make_bugreport_url(bugno, msgno=None, *, mbox=False):
+    '''
+    return bugreport.cgi URL for the bug (or for the particular message)
+    '''
+    url = f'https://bugs.debian.org/cgi-bin/bugreport.cgi?bug={int(bugno)}'
+    if msgno is not None:
+        url += f';msg={int(msgno)}'
+    if mbox:
+        url += ';mbox=yes'
+    return url
+
+def fetch_html(bugno, *, session):
+    url = make_bugreport_url(bugno)
+    with session.get_stream(url) as data:
+        html = lxml.html.parse(data).getroot()
+    html.make_links_absolute(base_url=url, handle_failures='ignore')
+    return html
+
+class _MboxMessage:
+
+    '''
+    single message downloaded from bugreport.cgi in the mbox format
+    '''
+
+    def __init__(self, msgno, fp):
+        self.id = msgno
+        self.header = email.parser.BytesParser(policy=email.policy.compat32).parse(fp)
+
+    @property
+    def body(self):
+        for part in self.header.walk():
+            if part.is_multipart():
+                continue
+            if part.get_content_type() != 'text/plain':
+                continue
+            if part.get_content_disposition() == 'attachment':
+                continue
+            charset = part.get_content_charset() or 'US-ASCII'
+            payload = part.get_payload(decode=True)
+            try:
+                return payload.decode(charset, 'replace')
+            except LookupError:
+                return payload.decode('US-ASCII', 'replace')
+        return ''
+
+def fetch_message(bugno, msgno, *, session):
+    url = make_bugreport_url(bugno, msgno, mbox=True)
+    with session.get_stream(url) as fp:
+        return _MboxMessage(msgno, fp)
+
+def _completed_future(result):
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+class BugData:
+
+    '''
+    futures for everything that is needed to show the bug
+    '''
+
+    def __init__(self, bugno, *, status=None, msgs=None, since=None, unchanged=False, options):
+        self.bugno = bugno
+        self.since = since
+        self.unchanged = unchanged
+        self.last = options.last
+        self.messages = None
+        executor = options.executor
+        session = options.session
+        debsoap_client = options.debsoap_client
+        if unchanged:
+            # nothing new to show; don't download anything
+            self.html = self.version_graph = _completed_future(None)
+            self.status = _completed_future(status)
+            self.log = debsoap.BugLog([])
+            return
+        # Only selected messages are shown,
+        # so the HTML page (which includes all of them) is not worth downloading.
+        log_only = options.fast or options.last is not None or msgs is not None
+        if log_only:
+            self.html = _completed_future(None)
+        else:
+            self.html = executor.submit(fetch_html, bugno, session=session)
+        if status is None:
+            self.status = executor.submit(debsoap_client.get_status, bugno)
+        else:
+            self.status = _completed_future(status)
+        if msgs is not None:
+            self.log = debsoap.BugLog([])
+            self.messages = [
+                executor.submit(fetch_message, bugno, msgno, session=session)
+                for msgno in msgs
+                if since is None or msgno > since
+            ]
+        else:
+            # messages are parsed in the background,
+            # and can be printed while the rest of the log is still being downloaded
+            self.log = debsoap_client.get_log(bugno, lazy=True, executor=options.log_executor)
+        # The version graph URL is known only after the HTML (or the status) has been fetched.
+        # That task was submitted earlier, so it is already running
+        # by the time this one starts, and waiting for it cannot deadlock.
+        # The graph is computed from a local changelog if possible;
+        # otherwise it's fetched from version.cgi.
+        version_graphs = options.version_graphs
+        if log_only:
+            self.version_graph = executor.submit(
+                lambda: version_graphs.get_for_status(self.status.result())
+            )
+        else:
+            self.version_graph = executor.submit(
+                lambda: version_graphs.get_for_status(
+                    self.status.result(),
+                    lambda: extract_version_graph_url(self.html.result()),
+                )
+            )
+
+    def cancel(self):
+        for future in [self.version_graph, self.status, self.html, *(self.messages or ())]:
+            future.cancel()
+        self.log.close()
 
 def print_header(_h, _s=None, **kwargs):
     template = '{t.yellow}' + _h + ':{t.off}'
@@ -164,15 +429,31 @@ def print_message(message, attachments=()):
     for line in body.splitlines():
         colorterm.print('{l}', l=line)
 
-def run_one(bugno, *, options):
+def show_bug(data, *, options):
+    bugno = data.bugno
     print_header('Location', '{t.cyan}{t.bold}https://bugs.debian.org/{N}{t.off}', N=bugno)
-    session = options.session
-    url = f'https://bugs.debian.org/cgi-bin/bugreport.cgi?bug={bugno}'
-    data = session.get(url)
-    html = lxml.html.fromstring(data)
-    html.make_links_absolute(base_url=url, handle_failures='ignore')
-    debsoap_client = debsoap.Client(session=session)
-    status = debsoap_client.get_status(bugno)
+    status = data.status.result()
+    if data.unchanged:
+        colorterm.print('No new messages.')
+        colorterm.print_hr()
+        colorterm.print()
+        return
+    last_msgno = show_bug_messages(data, status, options=options)
+    if last_msgno is not None and options.store is not None:
+        try:
+            options.store.set_seen(status, last_msgno)
+            options.store.commit()
+        except sqlite3.OperationalError as exc:
+            # e.g. the database is locked by another dbts process
+            print(f'dbts: warning: cannot record seen messages of bug #{bugno}: {exc}', file=sys.stderr)
+
+def show_bug_messages(data, status, *, options):
+    '''
+    print the status and the messages;
+    return the number of the last message
+    '''
+    bugno = data.bugno
+    last_msgno = None
     print_header('Subject', '{t.bold}{subject}{t.off}', subject=status.subject)
     if ',' not in status.package and status.package.startswith('src:'):
         print_header('Source', '{t.bold}{pkg}{t.off}', pkg=status.package[4:])
@@ -188,9 +469,11 @@ def run_one(bugno, *, options):
             print_header('Source', '{pkg}', pkg=status.source)
     # TODO: use SOAP to extract Maintainer
     # https://bugs.debian.org/553661
-    print_header('Maintainer', '{maint}',
-        maint=str.join(', ', extract_maintainers(html))
-    )
+    html = data.html.result()
+    if html is not None:
+        print_header('Maintainer', '{maint}',
+            maint=str.join(', ', extract_maintainers(html))
+        )
     if status.affects:
         print_header('Affects')
         for apkg in status.affects:
@@ -209,7 +492,7 @@ def run_one(bugno, *, options):
     print_header('Severity', severity_color + '{severity}{t.off}',
         severity=status.severity,
     )
-    version_graph = extract_bug_version_graph(html, options=options)
+    version_graph = data.version_graph.result()
     if status.tags:
         print_header('Tags', '{tags}', tags=str.join(' ', status.tags))
     if status.merged_with:
@@ -241,8 +524,38 @@ def run_one(bugno, *, options):
         print_header('Archived', 'yes')
     if status.forwarded:
         print_header('Forwarded', '{url}', url=status.forwarded)
+    if html is None:
+        print_header('Skipped', 'Maintainer, attachments, control messages')
     colorterm.print_hr()
-    bug_log = debsoap_client.get_log(bugno)
+    sys.stdout.flush()
+    bug_log = data.log
+    since = data.since
+    if since is None:
+        since = -1
+    if data.messages is not None:
+        for future in data.messages:
+            message = future.result()
+            print_header('Location', '{t.cyan}https://bugs.debian.org/{N}#{id}{t.off}', N=bugno, id=message.id)
+            print_message(message)
+            colorterm.print_hr()
+            sys.stdout.flush()
+        colorterm.print()
+        # only some messages were shown; don't mark anything as seen
+        return
+    if html is None:
+        messages = bug_log.drain()
+        if data.last is not None:
+            messages = collections.deque(messages, maxlen=data.last)
+        for message in messages:
+            last_msgno = message.id
+            if message.id <= since:
+                continue
+            print_header('Location', '{t.cyan}https://bugs.debian.org/{N}#{id}{t.off}', N=bugno, id=message.id)
+            print_message(message)
+            colorterm.print_hr()
+            sys.stdout.flush()
+        colorterm.print()
+        return last_msgno
     html_messages = html.xpath('//*[@class="msgreceived"]')
     attachments = extract_attachments(html)
     for html_message in html_messages:
@@ -250,22 +563,21 @@ def run_one(bugno, *, options):
         if not anchors:
             continue
         msgno = int(anchors[0])
+        last_msgno = msgno
+        if msgno <= since:
+            bug_log.pop(msgno, None)
+            continue
         print_header('Location', '{t.cyan}https://bugs.debian.org/{N}#{id}{t.off}', N=bugno, id=msgno)
         try:
-            message = bug_log[msgno]
+            message = bug_log.pop(msgno)
         except KeyError:
             print_control_message(html_message)
         else:
             print_message(message, attachments=attachments[msgno])
         colorterm.print_hr()
+        sys.stdout.flush()
     colorterm.print()
-    if options.merged:
-        options.merged = False
-        try:
-            for mbug in status.merged_with:
-                run_one(mbug, options=options)
-        finally:
-            options.merged = True
+    return last_msgno
 
 __all__ = [
     'add_argument_parser',
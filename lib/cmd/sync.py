@@ -0,0 +1,60 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+'the “sync” command'
+
+import concurrent.futures
+
+from lib import bugstore
+from lib import debsoap
+from lib.cmd import ls
+
+def add_argument_parser(subparsers):
+    ap = subparsers.add_parser('sync')
+    ap.add_argument('selections', metavar='SELECTION', type=str, nargs='+')
+    return ap
+
+def run(options):
+    debsoap_client = debsoap.Client(
+        session=options.session,
+        max_workers=options.jobs,
+        batch_size=options.batch_size,
+        batch_time=options.batch_time,
+    )
+    queries = ls.parse_selections(options)
+    with bugstore.Store() as store:
+        bug_numbers = set()
+        selector_queries = []
+        for query in queries:
+            if isinstance(query, int):
+                bug_numbers.add(query)
+            else:
+                selector_queries += [query]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=options.jobs) as executor:
+            results = executor.map(debsoap_client.query_bugs, selector_queries)
+            for query, query_bug_numbers in zip(selector_queries, results):
+                store.set_selection(query, query_bug_numbers)
+                bug_numbers.update(query_bug_numbers)
+        # The SOAP interface has no cheaper way to learn last_modified,
+        # so statuses are fetched for all bugs,
+        # but only new or modified bugs are written to the store.
+        last_modified = store.get_last_modified()
+        n_new = n_updated = 0
+        for bug in debsoap_client.get_bugs(*bug_numbers):
+            old_last_modified = last_modified.get(bug.id)
+            if old_last_modified is None:
+                n_new += 1
+            elif old_last_modified != bug.as_dict()['last_modified']:
+                n_updated += 1
+            else:
+                continue
+            store.put(bug)
+        n_unchanged = len(bug_numbers) - n_new - n_updated
+        print(f'{n_new} new, {n_updated} updated, {n_unchanged} unchanged')
+
+__all__ = [
+    'add_argument_parser',
+    'run'
+]
+
+# vim:ts=4 sts=4 sw=4 et
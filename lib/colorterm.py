@@ -5,10 +5,12 @@
 color terminal support
 '''
 
-import builtins
 import codecs
+import contextlib
+import functools
 import os
 import re
+import string
 import sys
 
 try:
@@ -28,8 +30,30 @@ class _seq:
     reverse = '\x1B[7m'
     unreverse = '\x1B[27m'
 
+_buffer = None
+
 def print(_s='', **kwargs):
-    builtins.print(format(_s, **kwargs))
+    s = format(_s, **kwargs) + '\n'
+    if _buffer is None:
+        sys.stdout.write(s)
+    else:
+        _buffer.append(s)
+
+@contextlib.contextmanager
+def buffered():
+    '''
+    collect output of print() and write it at once, at the end
+    '''
+    global _buffer  # pylint: disable=global-statement
+    if _buffer is not None:
+        yield
+        return
+    _buffer = []
+    try:
+        yield
+        sys.stdout.write(str.join('', _buffer))
+    finally:
+        _buffer = None
 
 def _quote_unsafe_char(ch):
     if ch < ' ' or ch == '\x7F':
@@ -51,10 +75,27 @@ def _encoding_error_handler(exc):
 
 codecs.register_error('_dbts_colorterm', _encoding_error_handler)
 
+_is_safe = re.compile('[ -~]*').fullmatch
+
+# encoding => {string: quoted string}
+_quote_cache = {}
+_quote_cache_size = 10000
+
 def _quote(s):
     if not isinstance(s, str):
         return s
+    if _is_safe(s):
+        # printable ASCII; nothing to do
+        return s
     encoding = sys.stdout.encoding
+    try:
+        cache = _quote_cache[encoding]
+    except KeyError:
+        cache = _quote_cache[encoding] = {}
+    try:
+        return cache[s]
+    except KeyError:
+        pass
     chunks = re.split(r'([\x00-\x1F\x7F-\x9F]+)', s)
     def esc():
         for i, s in enumerate(chunks):
@@ -62,11 +103,34 @@ def _quote(s):
                 yield _quote_unsafe(s)
             else:
                 yield s.encode(encoding, '_dbts_colorterm').decode(encoding)
-    return str.join('', esc())
+    result = str.join('', esc())
+    if len(cache) >= _quote_cache_size:
+        cache.clear()
+    cache[s] = result
+    return result
+
+@functools.lru_cache(maxsize=None)
+def _compile(template):
+    '''
+    substitute {t.*} fields in the template
+    '''
+    result = []
+    for literal, field, spec, conv in string.Formatter().parse(template):
+        result += [literal.replace('{', '{{').replace('}', '}}')]
+        if field is None:
+            continue
+        if field.startswith('t.'):
+            result += [getattr(_seq, field[2:])]
+            continue
+        if conv:
+            field += '!' + conv
+        if spec:
+            field += ':' + spec
+        result += ['{', field, '}']
+    return str.join('', result)
 
 def format(_s, **kwargs):
-    kwargs.update(t=_seq)
-    return _s.format_map({
+    return _compile(_s).format_map({
         key: _quote(value)
         for key, value in kwargs.items()
     })
@@ -81,6 +145,7 @@ def print_hr():
     print('{t.black}{t.bold}{s}{t.off}', s=s)
 
 __all__ = [
+    'buffered',
     'format',
     'print',
     'print_hr',
@@ -32,19 +32,36 @@ wnpp_tags = {
 }
 
 def parse_bugspec(s):
-    match = re.match(r'\A[#]?([0-9]+)\Z', s)
+    '''
+    parse bug number;
+    message numbers are accepted only as parts of URLs, and ignored
+    '''
+    if '#' in s.lstrip('#') and '://' not in s:
+        raise ValueError
+    (n, msgno) = parse_msgspec(s)
+    return n
+
+def parse_msgspec(s):
+    '''
+    parse bug number, optionally followed by message number;
+    return (bug number, message number or None)
+    '''
+    match = re.match(r'\A[#]?([0-9]+)(?:#([0-9]+))?\Z', s)
     if match is not None:
-        n = match.group(1)
-        return int(n)
+        n, msgno = match.groups()
+        return (int(n), _int_or_none(msgno))
     url = urllib.parse.urlparse(s)
     if url.scheme not in {'http', 'https'}:
         raise ValueError
     if url.netloc != 'bugs.debian.org':
         raise ValueError
+    msgno = None
+    if re.match(r'\A[0-9]+\Z', url.fragment):
+        msgno = url.fragment
     match = re.match(r'\A/([0-9]+)\Z', url.path)
     if match is not None:
         n = match.group(1)
-        return int(n)
+        return (int(n), _int_or_none(msgno))
     if url.path != '/cgi-bin/bugreport.cgi':
         raise ValueError
     query = url.query.replace(';', '&')
@@ -53,7 +70,14 @@ def parse_bugspec(s):
         [n] = query['bug']
     except KeyError:
         raise ValueError
-    return int(n)
+    if 'msg' in query:
+        [msgno] = query['msg']
+    return (int(n), _int_or_none(msgno))
+
+def _int_or_none(s):
+    if s is None:
+        return
+    return int(s)
 
 def is_architecture(s):
     match = re.match(r'\A[a-z][a-z0-9-]*\Z', s)
@@ -74,6 +98,7 @@ __all__ = [
     'is_package_name',
     'is_package_version',
     'parse_bugspec',
+    'parse_msgspec',
     'rc_severities',
     'severities',
     'wnpp_tags',
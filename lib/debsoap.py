@@ -6,12 +6,20 @@ Debian BTS SOAP client
 '''
 
 import base64
+import calendar
+import collections
+import concurrent.futures
 import datetime
-import email
+import email.parser
+import threading
+import time
 import xml.sax.saxutils as saxutils
 
 import lxml.etree
 
+from lib import utils
+from lib import web
+
 def _get_text(elem):
     tp = elem.get('{http://www.w3.org/1999/XMLSchema-instance}type')
     if tp == 'xsd:base64Binary':
@@ -19,133 +27,225 @@ def _get_text(elem):
     else:
         return elem.text
 
-class BugStatus:
-
-    def __init__(self, xml):
-        self._xml = xml
-
-    @property
-    def id(self):
-        return int(self._get('key'))
-
-    @property
-    def subject(self):
-        return self._get('subject')
-
-    @property
-    def package(self):
-        return self._get('package')
-
-    @property
-    def source(self):
-        return self._get('source')
-
-    @property
-    def affects(self):
-        return (self._get('affects') or '').split()
-
-    @property
-    def owner(self):
-        return self._get('owner')
-
-    @property
-    def submitter(self):
-        return self._get('originator')
-
-    @property
-    def date(self):
-        ts = int(self._get('date'))
-        return datetime.datetime.utcfromtimestamp(ts)
-
-    @property
-    def severity(self):
-        return self._get('severity')
-
-    @property
-    def tags(self):
-        return (self._get('tags') or '').split()
+def _int_list(s):
+    return [int(x) for x in (s or '').split()]
 
-    @property
-    def merged_with(self):
-        return self._get_int_list('mergedwith')
+def _str_list(s):
+    return (s or '').split()
 
-    @property
-    def found_versions(self):
-        return self._get_list('found_versions')
-
-    @property
-    def fixed_versions(self):
-        return self._get_list('fixed_versions')
+def _timestamp(s):
+    return datetime.datetime.utcfromtimestamp(int(s))
 
-    @property
-    def blocked_by(self):
-        return self._get_int_list('blockedby')
-
-    @property
-    def blocks(self):
-        return self._get_int_list('blocks')
-
-    @property
-    def done(self):
-        return self._get('done')
-
-    @property
-    def archived(self):
-        return bool(int(self._get('archived')))
+class BugStatus:
 
-    @property
-    def forwarded(self):
-        return self._get('forwarded')
+    '''
+    bug status, decoded eagerly from the SOAP item
+    '''
+
+    # SOAP name → (attribute name, conversion function)
+    _fields = dict(
+        subject=('subject', None),
+        package=('package', None),
+        source=('source', None),
+        affects=('affects', _str_list),
+        owner=('owner', None),
+        originator=('submitter', None),
+        date=('date', _timestamp),
+        last_modified=('last_modified', _timestamp),
+        severity=('severity', None),
+        tags=('tags', _str_list),
+        mergedwith=('merged_with', _int_list),
+        found_versions=('found_versions', list),
+        fixed_versions=('fixed_versions', list),
+        blockedby=('blocked_by', _int_list),
+        blocks=('blocks', _int_list),
+        done=('done', None),
+        archived=('archived', lambda s: bool(int(s))),
+        forwarded=('forwarded', None),
+    )
+
+    field_names = ('id', *(attr for attr, conv in _fields.values()))
+
+    __slots__ = field_names
 
-    def _get(self, name):
-        elem = self._xml.find('.//{Debbugs/SOAP}' + name)
-        return _get_text(elem)
+    def __init__(self, xml):
+        for attr in self.__slots__:
+            setattr(self, attr, None)
+        self.found_versions = []
+        self.fixed_versions = []
+        self.affects = []
+        self.tags = []
+        self.merged_with = []
+        self.blocked_by = []
+        self.blocks = []
+        self.archived = False
+        # xml is either <item><key>N</key><value>...</value></item>,
+        # or (for responses to single-bug queries) <value>...</value>
+        fields = xml
+        for elem in xml:
+            name = elem.tag.rpartition('}')[2]
+            if name == 'key':
+                self.id = int(elem.text)
+            elif name == 'value':
+                fields = elem
+        for elem in fields:
+            name = elem.tag.rpartition('}')[2]
+            try:
+                attr, conv = self._fields[name]
+            except KeyError:
+                if name == 'bug_num' and self.id is None:
+                    self.id = int(elem.text)
+                continue
+            if conv is list:
+                value = [item.text for item in elem if item.text is not None]
+            else:
+                value = _get_text(elem)
+                if value is None:
+                    continue
+                if conv is not None:
+                    value = conv(value)
+            setattr(self, attr, value)
+
+    _datetime_attrs = {'date', 'last_modified'}
+
+    def as_dict(self):
+        '''
+        return the fields as a JSON-serializable dict;
+        dates are converted to Unix timestamps
+        '''
+        d = {}
+        for attr in self.__slots__:
+            value = getattr(self, attr)
+            if attr in self._datetime_attrs and value is not None:
+                value = calendar.timegm(value.utctimetuple())
+            d[attr] = value
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        '''
+        reverse of as_dict()
+        '''
+        self = cls.__new__(cls)
+        for attr in self.__slots__:
+            value = d.get(attr)
+            if attr in self._datetime_attrs and value is not None:
+                value = _timestamp(value)
+            setattr(self, attr, value)
+        return self
 
-    def _get_list(self, name):
-        xp = './/d:' + name + '/d:item/text()'
-        return self._xml.xpath(xp, namespaces=dict(d='Debbugs/SOAP'))
+class BugLog:
 
-    def _get_int_list(self, name):
-        s = self._xml.find('.//{Debbugs/SOAP}' + name).text or ''
-        return [int(x) for x in s.split()]
+    '''
+    bug log, indexed by message number;
+    message headers and bodies are decoded only on demand
 
-class BugLog:
+    If lazy is true, messages are taken from xml only when they are asked for,
+    so they can be used while the rest of the log is still being downloaded.
+    '''
 
-    def __init__(self, xml):
+    def __init__(self, xml, *, lazy=False):
         self._messages = {}
-        for elem in xml:
+        self._source = iter(xml)
+        if not lazy:
+            self._read()
+
+    def _read(self, n=None):
+        '''
+        read messages from the source,
+        until message n (or any later message) has been read;
+        messages arrive in order
+        '''
+        if self._source is None:
+            return
+        for elem in self._source:
             message = BugMessage(elem)
             self._messages[message.id] = message
+            if n is not None and message.id >= n:
+                return
+        self._source = None
+
+    def close(self):
+        if self._source is not None:
+            close = getattr(self._source, 'close', None)
+            if close is not None:
+                close()
+            self._source = None
 
     def __iter__(self):
-        for n, message in sorted(self._messages.items()):
-            del n
-            yield message
+        self._read()
+        for n in sorted(self._messages):
+            yield self._messages[n]
+
+    def __len__(self):
+        self._read()
+        return len(self._messages)
+
+    def __contains__(self, n):
+        if n not in self._messages:
+            self._read(n)
+        return n in self._messages
 
     def __getitem__(self, n):
+        if n not in self._messages:
+            self._read(n)
         return self._messages[n]
 
+    def pop(self, n, *default):
+        '''
+        remove the message from the log and return it
+        '''
+        if n not in self._messages:
+            self._read(n)
+        return self._messages.pop(n, *default)
+
+    def drain(self):
+        '''
+        yield messages in order, removing them from the log,
+        so that memory can be freed as soon as each message has been processed
+        '''
+        for n in sorted(self._messages):
+            yield self._messages.pop(n)
+        if self._source is None:
+            return
+        for elem in self._source:
+            yield BugMessage(elem)
+        self._source = None
+
 class BugMessage:
 
+    __slots__ = ('_xml', 'id', '_header', '_body')
+
+    _unset = object()
+
     def __init__(self, xml):
         self._xml = xml
+        self._header = self._body = self._unset
+        self.id = int(self._get('msg_num'))
 
     def _get(self, name):
         elem = self._xml.find('./{Debbugs/SOAP}' + name)
         return _get_text(elem)
 
+    def _maybe_release(self):
+        if self._header is not self._unset and self._body is not self._unset:
+            # everything has been decoded; the XML is no longer needed
+            self._xml = None
+
     @property
     def header(self):
-        s = self._get('header')
-        return email.message_from_string(s)
+        if self._header is self._unset:
+            s = self._get('header')
+            self._header = email.parser.HeaderParser().parsestr(s)
+            self._maybe_release()
+        return self._header
 
     @property
     def body(self):
-        return self._get('body')
-
-    @property
-    def id(self):
-        return int(self._get('msg_num'))
+        if self._body is self._unset:
+            self._body = self._get('body')
+            self._maybe_release()
+        return self._body
 
 _query_template = '''\
 <soap:Envelope
@@ -163,6 +263,75 @@ _query_template = '''\
 </soap:Envelope>
 '''
 
+class _BatchSizer:
+
+    '''
+    adaptive get_status batch size
+
+    Batches are blocks of max_size bugs, or halves of such blocks,
+    or halves of the halves, and so on,
+    so that the possible requests (and therefore cache keys) are the same in every run.
+    After each response that was not taken from the cache,
+    the size is chosen so that requests take about target_time seconds
+    and return at most max_bytes bytes.
+    '''
+
+    max_bytes = 16 << 20
+
+    def __init__(self, max_size, *, target_time):
+        self._lock = threading.Lock()
+        self.max_size = max(1, max_size)
+        # the smallest blocks have 1 or 2 bugs:
+        self.max_level = self.max_size.bit_length() - 1
+        self.level = 0
+        self.target_time = target_time
+
+    @property
+    def size(self):
+        return self.max_size >> self.level
+
+    def get_end(self, start, level):
+        '''
+        return end of the block of the given level that starts at the given position;
+        return None if no such block starts there
+        '''
+        size = self.max_size
+        (base, pos) = divmod(start, size)
+        i = -(-(pos << level) // size)
+        if (i * size) >> level != pos:
+            return
+        return base * size + (((i + 1) * size) >> level)
+
+    def next_batch(self, start):
+        '''
+        return (end, level) of the next batch, which starts at the given position;
+        the batch is not larger than the current size
+        '''
+        # After the size has grown, smaller blocks are used
+        # until the position is aligned with a bigger one.
+        for level in range(self.level, self.max_level + 1):
+            end = self.get_end(start, level)
+            if end is not None:
+                return (end, level)
+        raise RuntimeError(f'no batch starts at {start}')
+
+    def update(self, n, elapsed, nbytes):
+        wanted = min(
+            self.target_time * n / max(elapsed, 1e-6),
+            self.max_bytes * n / max(nbytes, 1),
+        )
+        with self._lock:
+            old_size = self.size
+            level = 0
+            while level < self.max_level and (self.max_size >> level) > wanted:
+                level += 1
+            self.level = level
+            size = self.size
+        utils.debug(
+            f'get_status: {n} bugs, {elapsed:.2f} s, {nbytes} bytes ({nbytes // max(n, 1)} per bug); '
+            f'batch size: {old_size} -> {size}'
+        )
+
 class Client:
 
     _xsd_types = {
@@ -170,11 +339,29 @@ class Client:
         str: 'xsd:string',
     }
 
-    def __init__(self, *, session):
-        self._session = session
-        self._xml_parser = lxml.etree.XMLParser(resolve_entities=False)
+    _chunk_size = 1 << 16
+    pipeline_idle_time = 0.05
 
-    def _call(self, funcname, *args):
+    def __init__(self, *, session, max_workers=4, batch_size=500, batch_time=2.0):
+        '''
+        max_workers: maximum number of concurrent SOAP requests
+        batch_size: maximum number of bugs per get_status request
+        batch_time: target duration (in seconds) of a get_status request;
+        smaller batches are sent when requests take longer
+        '''
+        self._session = session
+        self.max_workers = max_workers
+        self.batch_size = max(1, batch_size)
+        self._sizer = _BatchSizer(batch_size, target_time=batch_time)
+
+    def _call(self, funcname, *args, stats=None):
+        '''
+        call the SOAP function;
+        yield the items of the result as they are parsed
+
+        If stats is not None, stats['bytes'] is set to the size of the (decompressed) response,
+        and stats['cached'] tells whether the response was taken from the cache.
+        '''
         args = (
             '<v xsi:type="{tp}">{v}</v>'.format(
                 v=saxutils.escape(str(value)),
@@ -192,60 +379,241 @@ class Client:
             'Content-Type': 'application/soap+xml; charset=UTF-8',
             'Content-Length': str(len(data)),
         }
-        response = self._session.post(url='https://bugs.debian.org/cgi-bin/soap.cgi',
+        # lxml parsers must not be shared between threads,
+        # so every call gets a fresh one
+        parser = lxml.etree.XMLPullParser(events=('start', 'end'), resolve_entities=False)
+        depth = 0
+        item_depth = None
+        with self._session.post_stream(url='https://bugs.debian.org/cgi-bin/soap.cgi',
             headers=headers,
             data=data,
-        )
-        tree = lxml.etree.fromstring(response, parser=self._xml_parser)
-        [result] = tree.find('{http://schemas.xmlsoap.org/soap/envelope/}Body')
-        return result
+        ) as response:
+            if stats is not None:
+                # only responses downloaded from the network have headers
+                stats['cached'] = getattr(response, 'headers', None) is None
+            eof = False
+            nbytes = 0
+            while not eof:
+                chunk = response.read(self._chunk_size)
+                nbytes += len(chunk)
+                if stats is not None:
+                    stats['bytes'] = nbytes
+                if chunk:
+                    parser.feed(chunk)
+                else:
+                    parser.close()
+                    eof = True
+                for event, elem in parser.read_events():
+                    if event == 'start':
+                        depth += 1
+                        if elem.tag == '{http://schemas.xmlsoap.org/soap/envelope/}Body':
+                            # Body → funcnameResponse → result → item
+                            item_depth = depth + 3
+                        continue
+                    if depth == item_depth:
+                        # detach the item, so that the memory used by
+                        # the already processed part of the document can be freed
+                        elem.getparent().remove(elem)
+                        yield elem
+                    depth -= 1
 
     def get_status(self, n):
-        xml = self._call('get_status', n)
+        [xml] = self._call('get_status', n)
         return BugStatus(xml)
 
-    def get_log(self, n):
-        [xml] = self._call('get_bug_log', n)
-        return BugLog(xml)
-
-    def get_bugs(self, *queries):
+    def get_log(self, n, *, lazy=False, executor=None):
+        '''
+        If lazy is true, return as soon as possible,
+        and parse messages only when they are asked for.
+        If executor is not None, download and parse the log in the background.
+        '''
+        items = self._call('get_bug_log', n)
+        if executor is not None:
+            items = utils.iter_in_background(executor, items)
+        return BugLog(items, lazy=lazy)
+
+    def query_bugs(self, query):
+        '''
+        return numbers of bugs matching the query
+        '''
         def flatten_dict(d):
             for k, v in d.items():
                 yield k
                 yield v
-        bug_numbers = set()
-        for query in queries:
-            if isinstance(query, int):
-                bug_numbers.add(query)
-                continue
-            if 'newest' in query:
-                [n] = query.values()
-                n = int(n)
-                [xml] = self._call('newest_bugs', n)
+        if 'newest' in query:
+            [n] = query.values()
+            n = int(n)
+            items = self._call('newest_bugs', n)
+        else:
+            items = self._call('get_bugs', *flatten_dict(query))
+        return [
+            int(elem.text)
+            for elem in items
+        ]
+
+    def _get_status_batch(self, bug_group):
+        stats = {}
+        start = time.monotonic()
+        bugs = [BugStatus(elem) for elem in self._call('get_status', *bug_group, stats=stats)]
+        elapsed = time.monotonic() - start
+        if len(bug_group) != len(bugs):
+            raise RuntimeError(f'expected {len(bug_group)} bugs, got {len(bugs)}')
+        if not stats['cached']:
+            self._sizer.update(len(bug_group), elapsed, stats['bytes'])
+        return bugs
+
+    def _get_status_block(self, bug_numbers, start, level):
+        '''
+        get statuses of the batch of the given level
+        that starts at the given position of bug_numbers
+        '''
+        end = self._sizer.get_end(start, level)
+        try:
+            return self._get_status_batch(bug_numbers[start:end])
+        except web.OfflineError:
+            if level >= self._sizer.max_level:
+                raise
+        # The batches might have been smaller when the responses were cached.
+        mid = self._sizer.get_end(start, level + 1)
+        bugs = self._get_status_block(bug_numbers, start, level + 1)
+        if mid < len(bug_numbers):
+            bugs += self._get_status_block(bug_numbers, mid, level + 1)
+        return bugs
+
+    def get_bugs(self, *queries, pipelined=False, ordered=False):
+        '''
+        yield BugStatus objects for bugs matching any of the queries;
+        in the pipelined mode, status requests are sent while the queries are still running;
+        in the ordered mode, bugs are yielded in descending bug number order
+        '''
+        if pipelined and ordered:
+            raise ValueError('pipelined and ordered modes are mutually exclusive')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            if pipelined:
+                yield from self._get_bugs_pipelined(executor, queries)
+            elif ordered:
+                yield from self._get_bugs_ordered(executor, queries)
             else:
-                [xml] = self._call('get_bugs', *flatten_dict(query))
-            bug_numbers.update(
-                int(elem.text)
-                for elem in xml.findall('./{Debbugs/SOAP}item')
-            )
-        def groupby(iterable, n):
-            a = []
-            for o in iterable:
-                a += [o]
-                if len(a) == n:
-                    yield a
-                    a = []
-            if a:
-                yield a
-        batch_size = 500
-        for bug_group in groupby(sorted(bug_numbers), batch_size):
+                yield from self._get_bugs(executor, queries)
+
+    def get_bug_numbers(self, *queries):
+        '''
+        return set of numbers of bugs matching any of the queries;
+        statuses are not fetched
+        '''
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return self._query_all(executor, queries)
+
+    def _query_all(self, executor, queries):
+        bug_numbers = set()
+        futures = []
+        try:
+            for query in queries:
+                if isinstance(query, int):
+                    bug_numbers.add(query)
+                else:
+                    futures += [executor.submit(self.query_bugs, query)]
+            for future in futures:
+                bug_numbers.update(future.result())
+        finally:
+            for future in futures:
+                future.cancel()
+        return bug_numbers
+
+    def _get_bugs(self, executor, queries):
+        bug_numbers = self._query_all(executor, queries)
+        futures = set()
+        try:
+            bug_numbers = sorted(bug_numbers)
             # sort() is here only to make HTTP requests reproducible;
             # no particular output order is guaranteed
-            [xml] = self._call('get_status', *bug_group)
-            if len(bug_group) != len(xml):
-                raise RuntimeError(f'expected {len(bug_numbers)} bugs, got {len(xml)}')
-            for elem in xml:
-                yield BugStatus(elem)
+            i = 0
+            while i < len(bug_numbers) or futures:
+                while i < len(bug_numbers) and len(futures) < self.max_workers:
+                    (j, level) = self._sizer.next_batch(i)
+                    futures.add(executor.submit(self._get_status_block, bug_numbers, i, level))
+                    i = j
+                done, futures = concurrent.futures.wait(futures,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _get_bugs_ordered(self, executor, queries):
+        bug_numbers = self._query_all(executor, queries)
+        bug_numbers = sorted(bug_numbers, reverse=True)
+        # Batches are sent newest first;
+        # every batch holds only lower numbers than the ones before,
+        # so merging the sorted batches amounts to yielding them in order.
+        futures = collections.deque()
+        try:
+            i = 0
+            while i < len(bug_numbers) or futures:
+                while i < len(bug_numbers) and len(futures) < self.max_workers:
+                    (j, level) = self._sizer.next_batch(i)
+                    futures.append(executor.submit(self._get_status_block, bug_numbers, i, level))
+                    i = j
+                future = futures.popleft()
+                bugs = future.result()
+                bugs.sort(key=(lambda bug: bug.id), reverse=True)
+                yield from bugs
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _get_bugs_pipelined(self, executor, queries):
+        seen = set()
+        pending = []
+        query_futures = set()
+        status_futures = set()
+        # when the last new bug number arrived:
+        last_arrival = time.monotonic()
+        def add(bug_numbers):
+            nonlocal last_arrival
+            for n in bug_numbers:
+                if n not in seen:
+                    seen.add(n)
+                    pending.append(n)
+                    last_arrival = time.monotonic()
+            while len(pending) >= self._sizer.size:
+                submit(self._sizer.size)
+        def submit(n):
+            bug_group = sorted(pending[:n])
+            del pending[:n]
+            status_futures.add(executor.submit(self._get_status_batch, bug_group))
+        try:
+            add(query for query in queries if isinstance(query, int))
+            for query in queries:
+                if not isinstance(query, int):
+                    query_futures.add(executor.submit(self.query_bugs, query))
+            while query_futures or status_futures or pending:
+                if pending and not query_futures:
+                    submit(len(pending))
+                timeout = None
+                if pending:
+                    timeout = max(0, last_arrival + self.pipeline_idle_time - time.monotonic())
+                done, _ = concurrent.futures.wait(
+                    query_futures | status_futures,
+                    timeout=timeout,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    if future in query_futures:
+                        query_futures.remove(future)
+                        add(future.result())
+                    else:
+                        status_futures.remove(future)
+                        yield from future.result()
+                if pending and time.monotonic() - last_arrival >= self.pipeline_idle_time:
+                    # no new bug numbers for a while;
+                    # don't keep the numbers we already have waiting
+                    submit(len(pending))
+        finally:
+            for future in query_futures | status_futures:
+                future.cancel()
 
 __all__ = [
     'BugLog',
@@ -43,10 +43,18 @@ class Graph:
         roots = set(self.nodes.keys())
         for dsts in self.edges.values():
             roots -= dsts
+        children = {
+            src: sorted(dsts, reverse=True)
+            for src, dsts in self.edges.items()
+        }
         seen = set()
-        def p(node_name, ilevel):
+        # depth-first traversal;
+        # iterative, because version graphs can be deeper than the recursion limit
+        stack = [(root, 0) for root in sorted(roots, reverse=True)]
+        while stack:
+            (node_name, ilevel) = stack.pop()
             if node_name in seen:
-                return
+                continue
             node = self.nodes[node_name]
             label = render(node)
             label = indent.indent(
@@ -56,10 +64,10 @@ class Graph:
             )
             print(label, file=file)
             seen.add(node_name)
-            for child in sorted(self.edges[node_name]):
-                p(child, ilevel + 1)
-        for root in sorted(roots):
-            p(root, 0)
+            stack += [
+                (child, ilevel + 1)
+                for child in children.get(node_name, ())
+            ]
 
     def pformat(self, *, render=str, bullet='∙'):
         fp = io.StringIO()
@@ -78,26 +86,74 @@ class Graph:
                 edges += [(x, y)]
         return f'{tp}({nodes!r}, {edges!r})'
 
+_qstring = r'''"([^"\\]*(?:\\.[^"\\]*)*)"'''
+_id = rf'''(?: {_qstring} | (\w+) )'''
+
+_header_re = re.compile(rf'''
+    \s* digraph \s* (?: {_id} )? \s* {{
+''', flags=(re.VERBOSE | re.DOTALL))
+
+_stmt_re = re.compile(rf'''
+    \s* (?:
+        (}}) \s* \Z
+      | ;
+      | {_id}
+        (?: \s* -> \s* {_id} )?
+        (?: \s* \[ ( [^\]"]* (?: "[^"\\]*(?:\\.[^"\\]*)*" [^\]"]* )* ) \] )?
+        \s* ;?
+    )
+''', flags=(re.VERBOSE | re.DOTALL))
+
+_attr_re = re.compile(rf'''
+    (\w+) \s* = \s* {_id}
+''', flags=(re.VERBOSE | re.DOTALL))
+
+def _unquote(s):
+    if '\\' not in s:
+        return s
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), s, flags=re.DOTALL)
+
+def _parse_attrs(s):
+    return {
+        name: value or _unquote(qvalue)
+        for name, qvalue, value in _attr_re.findall(s)
+    }
+
 def parse(dot_data):
-    match = re.match(r'\Adigraph\s*\w+\s*{\s*(.*)}\s*\Z', dot_data, flags=re.DOTALL)
-    lines = match.group(1)
+    # The data is scanned once, one statement at a time.
+    m = _header_re.match(dot_data)
+    if m is None:
+        raise ValueError('expected digraph')
+    pos = m.end()
+    match = _stmt_re.match
     nodes = set()
     edges = set()
-    for line in lines.splitlines():
-        match = re.match(r'^"([^"]+)"\s+\[(.*)\]$', line)
-        if match is not None:
-            [name, tattrs] = match.groups()
-            attrs = {}
-            for attr in re.findall(r'\w+="[^"]*"', tattrs):
-                aname, avalue = attr.split('=', 1)
-                avalue = avalue.strip('"')
-                avalue = avalue.replace(r'\n', '\n')
-                attrs[aname] = avalue
-            nodes.add(Node(name, **attrs))
+    # all edges typically have the same attributes:
+    attrs_cache = {}
+    while True:
+        m = match(dot_data, pos)
+        if m is None:
+            raise ValueError(f'syntax error at position {pos}')
+        pos = m.end()
+        (end, qname1, name1, qname2, name2, tattrs) = m.groups()
+        if end is not None:
+            break
+        if qname1 is not None:
+            name1 = _unquote(qname1)
+        elif name1 is None:
+            # empty statement
             continue
-        match = re.match(r'^"([^"]+)"->"([^"]+)"\s+\[dir="back"\]$', line)
-        [name1, name2] = match.groups()
-        edges.add((name2, name1))
+        if qname2 is not None:
+            name2 = _unquote(qname2)
+        attrs = attrs_cache.get(tattrs)
+        if attrs is None:
+            attrs = attrs_cache[tattrs] = _parse_attrs(tattrs or '')
+        if name2 is None:
+            nodes.add(Node(name1, **attrs))
+        elif attrs.get('dir') == 'back':
+            edges.add((name2, name1))
+        else:
+            edges.add((name1, name2))
     return Graph(nodes, edges)
 
 __all__ = [
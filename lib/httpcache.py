@@ -0,0 +1,213 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+'''
+persistent HTTP response cache
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+_magic = b'dbts-http-cache 1\n'
+
+class Entry:
+
+    '''
+    cached response;
+    the body can be read from the file attribute
+    '''
+
+    def __init__(self, meta, file):
+        self.meta = meta
+        self.file = file
+
+    @property
+    def age(self):
+        return time.time() - self.meta['stored']
+
+    @property
+    def body(self):
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class Writer:
+
+    '''
+    cache entry being written;
+    it becomes visible only after commit()
+    '''
+
+    def __init__(self, path, meta):
+        self._path = path
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp.')
+        self._file = os.fdopen(fd, 'wb')
+        try:
+            self._file.write(_magic)
+            self._file.write(json.dumps(meta).encode('UTF-8') + b'\n')
+        except BaseException:
+            self.abort()
+            raise
+
+    def write(self, data):
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self._tmp_path, self._path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+def make_key(method, url, data=None):
+    key = f'{method} {url}'
+    if data is not None:
+        key += ' ' + hashlib.sha256(data).hexdigest()
+    return key
+
+class Cache:
+
+    # minimum time (in seconds) between two prune() runs
+    prune_interval = 60 * 60
+
+    def __init__(self, path, *, max_size=(64 << 20)):
+        self.path = path
+        self.max_size = max_size
+
+    def _get_path(self, key):
+        digest = hashlib.sha256(key.encode('UTF-8')).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def get(self, key):
+        path = self._get_path(key)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        try:
+            if file.readline() != _magic:
+                file.close()
+                return
+            meta = json.loads(file.readline().decode('UTF-8'))
+            if meta.get('key') != key:
+                file.close()
+                return
+        except ValueError:
+            # corrupt entry; treat it as a cache miss
+            file.close()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return
+        except BaseException:
+            file.close()
+            raise
+        try:
+            # mtime is used for LRU eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return Entry(meta, file)
+
+    def writer(self, key, meta):
+        meta = dict(meta, key=key, stored=time.time())
+        path = self._get_path(key)
+        return Writer(path, meta)
+
+    def put(self, key, meta, body):
+        writer = self.writer(key, meta)
+        try:
+            writer.write(body)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def refresh(self, key, entry, meta):
+        '''
+        replace metadata of the entry;
+        return the new entry
+        '''
+        writer = self.writer(key, meta)
+        try:
+            shutil.copyfileobj(entry.file, writer)
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            entry.close()
+        writer.commit()
+        return self.get(key)
+
+    def prune(self, *, force=False):
+        '''
+        evict least recently used entries until the cache fits within max_size;
+        unless force is true, do nothing if the cache was pruned recently
+        '''
+        stamp_path = os.path.join(self.path, '.pruned')
+        if not force:
+            try:
+                st = os.stat(stamp_path)
+            except FileNotFoundError:
+                pass
+            else:
+                if 0 <= time.time() - st.st_mtime < self.prune_interval:
+                    return
+        entries = []
+        total_size = 0
+        try:
+            subdirs = os.listdir(self.path)
+        except FileNotFoundError:
+            return
+        with open(stamp_path, 'wb'):
+            pass
+        for subdir in subdirs:
+            subdir = os.path.join(self.path, subdir)
+            try:
+                names = os.listdir(subdir)
+            except NotADirectoryError:
+                continue
+            for name in names:
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries += [(st.st_mtime, st.st_size, path)]
+                total_size += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+__all__ = [
+    'Cache',
+    'Entry',
+    'Writer',
+    'make_key',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,154 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+'''
+binary package → source package index
+
+The index is built from APT package lists and the dpkg status file,
+and stored on disk as sorted "BINARY<TAB>SOURCE [SOURCE...]" lines,
+which are looked up by bisection in the mmap-ed file.
+It is rebuilt whenever the input files change.
+'''
+
+import glob
+import json
+import mmap
+import os
+import re
+import tempfile
+
+from lib import utils
+
+_magic = b'dbts-srcindex 1 '
+
+_field_re = re.compile(rb'^(Package|Source):[ \t]*([^\s(]+)', re.MULTILINE)
+
+def get_default_inputs():
+    return [
+        '/var/lib/dpkg/status',
+        *sorted(glob.glob('/var/lib/apt/lists/*_Packages')),
+    ]
+
+def _get_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature += [[path, st.st_mtime_ns, st.st_size]]
+    return signature
+
+def _read_mapping(path, mapping):
+    with open(path, 'rb') as file:
+        data = file.read()
+    package = None
+    # Within a paragraph, Package always comes before Source.
+    for match in _field_re.finditer(data):
+        (name, value) = match.groups()
+        if name == b'Package':
+            package = value
+            mapping.setdefault(package, set()).add(package)
+        elif package is not None:
+            sources = mapping[package]
+            sources.discard(package)
+            sources.add(value)
+            package = None
+
+class Index:
+
+    def __init__(self, path=None, *, inputs=None):
+        '''
+        path: where to store the index
+        inputs: package lists to build the index from
+        '''
+        if path is None:
+            path = utils.get_cache_dir('srcindex')
+        if inputs is None:
+            inputs = get_default_inputs()
+        self.path = path
+        self.inputs = inputs
+
+    def _build(self, signature):
+        mapping = {}
+        for path, mtime, size in signature:
+            _read_mapping(path, mapping)
+        header = _magic + json.dumps(signature).encode('UTF-8') + b'\n'
+        dirname = os.path.dirname(self.path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp.')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(header)
+                for package in sorted(mapping):
+                    sources = b' '.join(sorted(mapping[package]))
+                    file.write(package + b'\t' + sources + b'\n')
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        utils.debug(f'built source package index for {len(mapping)} packages')
+
+    def _open(self):
+        '''
+        return the up-to-date mmap-ed index, and the offset of the first record;
+        return None if there are no package lists
+        '''
+        signature = _get_signature(self.inputs)
+        if not signature:
+            return
+        header = _magic + json.dumps(signature).encode('UTF-8') + b'\n'
+        for i in range(2):
+            try:
+                file = open(self.path, 'rb')
+            except FileNotFoundError:
+                pass
+            else:
+                with file:
+                    if file.readline() == header:
+                        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), len(header)
+            if i == 0:
+                self._build(signature)
+        raise RuntimeError(f'cannot read {self.path}')
+
+    def get_sources(self, package):
+        '''
+        return sorted list of names of source packages that build the binary package;
+        return None if no package lists are available
+        '''
+        index = self._open()
+        if index is None:
+            return
+        (mm, lo) = index
+        with mm:
+            key = package.encode('UTF-8')
+            hi = len(mm)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                i = mm.rfind(b'\n', lo, mid)
+                start = lo if i < 0 else i + 1
+                end = mm.find(b'\n', start)
+                (name, sources) = mm[start:end].split(b'\t', 1)
+                if name < key:
+                    lo = end + 1
+                elif name > key:
+                    hi = start
+                else:
+                    return sources.decode('UTF-8').split(' ')
+        return []
+
+def get_sources(package):
+    '''
+    return sorted list of names of source packages that build the binary package,
+    according to the default index;
+    return None if no package lists are available
+    '''
+    return Index().get_sources(package)
+
+__all__ = [
+    'Index',
+    'get_default_inputs',
+    'get_sources',
+]
+
+# vim:ts=4 sts=4 sw=4 et
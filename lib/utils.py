@@ -6,8 +6,99 @@ various utilities
 '''
 
 import os
+import queue
 import signal
 import subprocess
+import sys
+import threading
+
+debug_enabled = False
+
+def debug(s):
+    if debug_enabled:
+        print(f'dbts: debug: {s}', file=sys.stderr)
+
+def get_cache_dir(*parts):
+    path = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(path, 'dbts', *parts)
+
+class _BackgroundIterator:
+
+    '''
+    iterator over items produced in the background;
+    close() stops the producer, whether or not the iteration has started
+    '''
+
+    _end = object()
+
+    def __init__(self, executor, iterable, *, maxsize):
+        self._iterable = iterable
+        self._items = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._done = False
+        self._future = executor.submit(self._produce)
+
+    def _produce(self):
+        items = self._items
+        stop = self._stop
+        try:
+            for item in self._iterable:
+                if stop.is_set():
+                    break
+                items.put((item, None))
+                if stop.is_set():
+                    break
+            else:
+                items.put((self._end, None))
+        except BaseException as exc:  # pylint: disable=broad-except
+            if not stop.is_set():
+                items.put((self._end, exc))
+        finally:
+            self._close_iterable()
+
+    def _close_iterable(self):
+        close = getattr(self._iterable, 'close', None)
+        if close is not None:
+            close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        item, exc = self._items.get()
+        if item is self._end:
+            self._done = True
+            if exc is not None:
+                raise exc
+            raise StopIteration
+        return item
+
+    def close(self):
+        if self._done:
+            return
+        self._done = True
+        self._stop.set()
+        if self._future.cancel():
+            # the producer has never started
+            self._close_iterable()
+            return
+        # Make room in the queue, so that the producer is not blocked on put(),
+        # and can notice that it should stop.
+        while True:
+            try:
+                self._items.get_nowait()
+            except queue.Empty:
+                break
+
+def iter_in_background(executor, iterable, *, maxsize=100):
+    '''
+    iterate over the iterable in the executor;
+    return an iterator over the items produced so far;
+    at most maxsize items are buffered
+    '''
+    return _BackgroundIterator(executor, iterable, maxsize=maxsize)
 
 def looks_like_path(s):
     return (
@@ -31,6 +122,10 @@ def xcmd(*cmdline):
     return proc.stdout
 
 __all__ = [
+    'debug',
+    'debug_enabled',
+    'get_cache_dir',
+    'iter_in_background',
     'looks_like_path',
     'raise_SIGPIPE',
     'xcmd',
@@ -0,0 +1,388 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+'''
+version graphs:
+fetched from version.cgi, or computed locally from changelogs
+'''
+
+import collections
+import concurrent.futures
+import functools
+import gzip
+import itertools
+import os
+import re
+import subprocess
+import threading
+import urllib.parse
+
+from lib import dotparser
+from lib import httpcache
+
+base_url = 'https://bugs.debian.org/cgi-bin/version.cgi'
+
+def _make_url(query):
+    query = str.join(';', (
+        f'{k}={urllib.parse.quote(v, safe="")}'
+        for k, v in query
+    ))
+    return f'{base_url}?{query}'
+
+def make_url(status):
+    '''
+    build the version.cgi URL from the bug status,
+    the same way bugreport.cgi does
+    '''
+    if not (status.found_versions or status.fixed_versions):
+        return
+    query = [('package', status.package)]
+    query += [('found', v) for v in status.found_versions]
+    query += [('fixed', v) for v in status.fixed_versions]
+    query += [('collapse', '1'), ('info', '1')]
+    return _make_url(query)
+
+def canonicalize_url(url):
+    '''
+    return the version.cgi URL with packages and versions sorted;
+    URLs that differ only in their order yield the same graph
+    '''
+    query = urllib.parse.urlsplit(url).query
+    query = [
+        (urllib.parse.unquote(k), urllib.parse.unquote(v))
+        for item in re.split('[;&]', query) if item
+        for k, _, v in [item.partition('=')]
+    ]
+    sorted_keys = ['package', 'found', 'fixed']
+    new_query = []
+    for key in sorted_keys:
+        new_query += sorted((k, v) for k, v in query if k == key)
+    new_query += [(k, v) for k, v in query if k not in sorted_keys]
+    return _make_url(new_query)
+
+def read_changelog(path):
+    '''
+    return list of (source, version) pairs from the Debian changelog,
+    newest first
+    '''
+    if path.endswith('.gz'):
+        file = gzip.open(path, 'rt', encoding='UTF-8', errors='replace')
+    else:
+        file = open(path, 'rt', encoding='UTF-8', errors='replace')
+    entries = []
+    with file:
+        for line in file:
+            match = _changelog_header_re.match(line)
+            if match is not None:
+                entries += [match.groups()]
+    return entries
+
+_changelog_header_re = re.compile(r'([a-z0-9][a-z0-9.+-]+) [(]([^ ()]+)[)]')
+
+class VersionTree:
+
+    '''
+    tree of source package versions, as used for BTS version tracking;
+    version names are SOURCE/VERSION
+    '''
+
+    def __init__(self):
+        self.source = None
+        self.parents = {}
+        self.children = collections.defaultdict(list)
+        # versions, each one after its parent:
+        self._order = []
+        self._by_version = collections.defaultdict(list)
+
+    def add(self, name, parent=None):
+        if name in self.parents:
+            return
+        self.parents[name] = parent
+        if parent is not None:
+            self.children[parent] += [name]
+        self._order += [name]
+        (source, _, version) = name.rpartition('/')
+        self._by_version[version] += [name]
+
+    @classmethod
+    def from_changelog(cls, entries):
+        '''
+        build the tree from changelog entries (newest first)
+        '''
+        tree = cls()
+        if entries:
+            [tree.source, _] = entries[0]
+        parent = None
+        for source, version in reversed(entries):
+            name = f'{source}/{version}'
+            if name in tree.parents:
+                continue
+            tree.add(name, parent)
+            parent = name
+        return tree
+
+    def resolve(self, version):
+        '''
+        return full name of the version (which may lack the source part),
+        or None if the version is unknown
+        '''
+        if version in self.parents:
+            return version
+        names = self._by_version.get(version, ())
+        if len(names) == 1:
+            [name] = names
+            return name
+
+    def get_states(self, found, fixed):
+        '''
+        return {version: state} for all the versions in the tree;
+        state is 'found', 'fixed' or None;
+        like the BTS, the nearest ancestor (including the version itself)
+        that is marked as found or fixed decides
+        '''
+        found = {self.resolve(v) for v in found}
+        fixed = {self.resolve(v) for v in fixed}
+        states = {}
+        for name in self._order:
+            if name in fixed:
+                state = 'fixed'
+            elif name in found:
+                state = 'found'
+            else:
+                parent = self.parents[name]
+                state = states[parent] if parent is not None else None
+            states[name] = state
+        return states
+
+    def is_buggy(self, version, found, fixed):
+        '''
+        return whether the version is affected by the bug with the found and fixed versions,
+        or None if the version is unknown
+        '''
+        name = self.resolve(version)
+        if name is None:
+            return
+        return self.get_states(found, fixed)[name] == 'found'
+
+    def make_graph(self, found, fixed, *, collapse=True):
+        '''
+        return dotparser.Graph, similar to that generated by version.cgi;
+        only the found and fixed versions and their descendants are included,
+        not the whole history
+        '''
+        states = self.get_states(found, fixed)
+        marked = {self.resolve(v) for v in [*found, *fixed]}
+        colors = dict(found='salmon', fixed='chartreuse')
+        parents = {}
+        for name in self._order:
+            parent = self.parents[name]
+            if name in marked:
+                parents[name] = parent if parent in parents else None
+            elif parent in parents:
+                parents[name] = parent
+        def is_boring(name):
+            # chain link that doesn't change anything
+            if not collapse or name in marked:
+                return False
+            parent = parents[name]
+            children = self.children[name]
+            return (
+                parent is not None and
+                len(children) == 1 and
+                states[name] == states[parent] == states[children[0]]
+            )
+        nodes = []
+        edges = []
+        # collapsed chain => its first version
+        heads = {}
+        for name in self._order:
+            if name not in parents:
+                continue
+            parent = parents[name]
+            if is_boring(name):
+                if parent in heads:
+                    heads[name] = heads[parent]
+                    continue
+                heads[name] = name
+                node = dotparser.Node(name, label='some versions')
+            else:
+                attrs = {}
+                color = colors.get(states[name])
+                if color is not None:
+                    attrs.update(fillcolor=color, style='filled')
+                node = dotparser.Node(name, **attrs)
+            nodes += [node]
+            if parent is not None:
+                edges += [(heads.get(parent, parent), name)]
+        return dotparser.Graph(nodes, edges)
+
+@functools.lru_cache(maxsize=None)
+def get_installed_source(package):
+    '''
+    return name of the source package of the installed binary package,
+    or None if the package is not installed
+    '''
+    try:
+        proc = subprocess.run(
+            ['dpkg-query', '-Wf', '${db:Status-Abbrev}\t${source:Package}\n', package],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=dict(os.environ, LC_ALL='C'),
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return
+    for line in proc.stdout.decode('ASCII', 'replace').splitlines():
+        (state, source) = line.split('\t')
+        # the second letter is the current package state;
+        # "n", "c" and "H" mean that the files are not (all) there
+        if state[1:2] in {'i', 'U', 'F', 'W', 't'} and source:
+            return source
+
+def find_changelogs(status):
+    '''
+    yield paths of changelogs of installed packages built from the bug's source package
+    '''
+    if status.source is None:
+        return
+    for pkg in status.package.split(','):
+        if pkg.startswith('src:'):
+            continue
+        if get_installed_source(pkg) != status.source:
+            continue
+        yield f'/usr/share/doc/{pkg}/changelog.Debian.gz'
+
+class Cache:
+
+    '''
+    version graphs, cached in memory and (optionally) on disk
+    '''
+
+    ttl = 24 * 60 * 60
+
+    def __init__(self, *, session, cache=None, changelog=None):
+        '''
+        session: web.UserAgent
+        cache: httpcache.Cache or None
+        changelog: path to an additional changelog to compute graphs from
+        '''
+        self.session = session
+        self.cache = cache
+        self.changelog = changelog
+        self._lock = threading.Lock()
+        self._graphs = {}
+        self._trees = {}
+
+    def get(self, url):
+        '''
+        return the version graph (as dotparser.Graph) for the version.cgi URL;
+        return None if url is None
+        '''
+        if url is None:
+            return
+        url = canonicalize_url(url)
+        with self._lock:
+            future = self._graphs.get(url)
+            owner = future is None
+            if owner:
+                future = self._graphs[url] = concurrent.futures.Future()
+        if not owner:
+            # another thread is already fetching the same graph
+            return future.result()
+        try:
+            graph = self._fetch(url)
+        except BaseException as exc:
+            with self._lock:
+                del self._graphs[url]
+            future.set_exception(exc)
+            raise
+        future.set_result(graph)
+        return graph
+
+    def get_tree(self, path):
+        '''
+        return VersionTree built from the changelog,
+        or None if it doesn't exist
+        '''
+        with self._lock:
+            try:
+                return self._trees[path]
+            except KeyError:
+                pass
+        try:
+            entries = read_changelog(path)
+        except (FileNotFoundError, NotADirectoryError):
+            tree = None
+        else:
+            tree = VersionTree.from_changelog(entries)
+        with self._lock:
+            self._trees[path] = tree
+        return tree
+
+    def get_local(self, status):
+        '''
+        compute the version graph for the bug from a local changelog;
+        return None if no suitable changelog is available
+        '''
+        versions = [*status.found_versions, *status.fixed_versions]
+        if not versions:
+            return
+        source = status.source
+        if source is None and status.package.startswith('src:') and ',' not in status.package:
+            source = status.package[4:]
+        paths = find_changelogs(status)
+        if self.changelog is not None:
+            paths = itertools.chain([self.changelog], paths)
+        for path in paths:
+            tree = self.get_tree(path)
+            if tree is None or tree.source != source:
+                continue
+            if any(tree.resolve(v) is None for v in versions):
+                # the changelog is too old (or the versions are on another branch)
+                continue
+            return tree.make_graph(status.found_versions, status.fixed_versions)
+
+    def get_for_status(self, status, get_url=None):
+        '''
+        return the version graph for the bug,
+        computed locally if possible, or fetched from version.cgi otherwise;
+        get_url() returns the version.cgi URL;
+        by default, the URL is built from the status
+        '''
+        graph = self.get_local(status)
+        if graph is not None:
+            return graph
+        if get_url is None:
+            url = make_url(status)
+        else:
+            url = get_url()
+        return self.get(url)
+
+    def _fetch(self, url):
+        key = httpcache.make_key('GRAPH', url)
+        dot_data = None
+        if self.cache is not None:
+            entry = self.cache.get(key)
+            if entry is not None:
+                with entry:
+                    if self.session.offline or entry.age < self.ttl:
+                        dot_data = entry.body
+        if dot_data is None:
+            # graphs are cached (if at all) in self.cache, not in the HTTP cache
+            dot_data = self.session.get(url + ';dot=1', cache=False)
+            if self.cache is not None:
+                self.cache.put(key, {}, dot_data)
+        dot_data = dot_data.decode('ASCII')
+        return dotparser.parse(dot_data)
+
+__all__ = [
+    'Cache',
+    'VersionTree',
+    'canonicalize_url',
+    'find_changelogs',
+    'get_installed_source',
+    'make_url',
+    'read_changelog',
+]
+
+# vim:ts=4 sts=4 sw=4 et
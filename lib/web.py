@@ -1,8 +1,184 @@
 # Copyright © 2017-2024 Jakub Wilk <jwilk@jwilk.net>
 # SPDX-License-Identifier: MIT
 
-import gzip
+import collections
+import http.client
+import io
+import ssl
+import threading
+import urllib.error
+import urllib.parse
 import urllib.request
+import zlib
+
+from lib import httpcache
+
+class OfflineError(RuntimeError):
+    pass
+
+class _ConnectionPool:
+
+    '''
+    pool of idle HTTP/1.1 keep-alive connections, keyed by (scheme, netloc)
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+        self._ssl_context = None
+        self.stats = collections.Counter()
+
+    def _connect(self, scheme, netloc):
+        proxy = None
+        proxies = urllib.request.getproxies()
+        host = urllib.parse.urlsplit(f'//{netloc}').hostname
+        if scheme in proxies and not urllib.request.proxy_bypass(host):
+            proxy = urllib.parse.urlsplit(proxies[scheme])
+        if scheme == 'https':
+            with self._lock:
+                if self._ssl_context is None:
+                    self._ssl_context = ssl.create_default_context()
+            if proxy is not None:
+                conn = http.client.HTTPSConnection(proxy.netloc, context=self._ssl_context)
+                conn.set_tunnel(netloc)
+            else:
+                conn = http.client.HTTPSConnection(netloc, context=self._ssl_context)
+        elif scheme == 'http':
+            conn = http.client.HTTPConnection(proxy.netloc if proxy else netloc)
+            conn.dbts_via_proxy = proxy is not None
+        else:
+            raise RuntimeError(f'unsupported URL scheme: {scheme!r}')
+        return conn
+
+    def acquire(self, scheme, netloc):
+        key = (scheme, netloc)
+        with self._lock:
+            idle = self._idle[key]
+            if idle:
+                self.stats['reused'] += 1
+                return idle.pop(), True
+            self.stats['opened'] += 1
+        return self._connect(scheme, netloc), False
+
+    def release(self, scheme, netloc, conn):
+        key = (scheme, netloc)
+        with self._lock:
+            self._idle[key] += [conn]
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = collections.defaultdict(list)
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+class _Connection:
+
+    '''
+    connection borrowed from the pool
+    '''
+
+    def __init__(self, pool, scheme, netloc, conn):
+        self._pool = pool
+        self._key = (scheme, netloc)
+        self._conn = conn
+
+    def release(self, response):
+        '''
+        return the connection to the pool;
+        the response must have been read completely
+        '''
+        if response.will_close:
+            self._conn.close()
+        else:
+            self._pool.release(*self._key, self._conn)
+
+    def discard(self, response):
+        '''
+        read and throw away the response body, then release the connection
+        '''
+        try:
+            response.read()
+        except BaseException:
+            self.close()
+            raise
+        self.release(response)
+
+    def close(self):
+        self._conn.close()
+
+class _Download:
+
+    '''
+    response body being downloaded (and optionally stored in the cache)
+    '''
+
+    def __init__(self, conn, response, cache_writer=None):
+        self.conn = conn
+        self.response = response
+        self.cache_writer = cache_writer
+        self._done = False
+
+    def finish(self):
+        '''
+        release the connection and commit the cache entry;
+        the response must have been read completely
+        '''
+        self._done = True
+        self.conn.release(self.response)
+        if self.cache_writer is not None:
+            self.cache_writer.commit()
+
+    def abort(self):
+        '''
+        close the connection and throw away the cache entry,
+        unless the download has already finished
+        '''
+        if self._done:
+            return
+        self._done = True
+        self.conn.close()
+        if self.cache_writer is not None:
+            self.cache_writer.abort()
+
+class _ChunkReader(io.RawIOBase):
+
+    '''
+    raw file-like object reading from an iterator over byte chunks
+    '''
+
+    def __init__(self, chunks, on_close=None):
+        super().__init__()
+        self._chunks = chunks
+        self._on_close = on_close
+        self._chunk = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._chunk):
+            try:
+                self._chunk = next(self._chunks)
+            except StopIteration:
+                return 0
+            self._offset = 0
+        n = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:n] = self._chunk[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._chunks.close()
+            finally:
+                # The generator's cleanup doesn't run if it has never been started.
+                if self._on_close is not None:
+                    self._on_close()
+        super().close()
 
 class UserAgent:
 
@@ -11,26 +187,213 @@ class UserAgent:
         'Accept-Encoding': 'gzip',
     }
 
-    def request(self, url, data=None, headers=(), method=None):
+    max_redirects = 10
+    chunk_size = 1 << 16
+
+    def __init__(self, *, cache=None, offline=False, get_ttl=0, post_ttl=0):
+        '''
+        cache: httpcache.Cache or None
+        offline: serve responses only from the cache
+        get_ttl: for how long (in seconds) cached GET responses are used without revalidation
+        post_ttl: for how long (in seconds) cached POST responses are used;
+        by default, they are used only in the offline mode
+        '''
+        self._pool = _ConnectionPool()
+        self.cache = cache
+        self.offline = offline
+        self.get_ttl = get_ttl
+        self.post_ttl = post_ttl
+
+    @property
+    def stats(self):
+        '''
+        number of HTTP connections opened and reused so far
+        '''
+        return dict(
+            opened=self._pool.stats['opened'],
+            reused=self._pool.stats['reused'],
+        )
+
+    def close(self):
+        self._pool.close()
+        if self.cache is not None:
+            self.cache.prune()
+
+    def _send(self, url, data, headers, method):
+        split_url = urllib.parse.urlsplit(url)
+        scheme = split_url.scheme
+        netloc = split_url.netloc
+        path = urllib.parse.urlunsplit(('', '', split_url.path or '/', split_url.query, ''))
+        while True:
+            conn, reused = self._pool.acquire(scheme, netloc)
+            selector = path
+            if getattr(conn, 'dbts_via_proxy', False):
+                selector = urllib.parse.urlunsplit((scheme, netloc, path, '', ''))
+            try:
+                conn.request(method, selector, body=data, headers=headers)
+                response = conn.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if reused:
+                    # the server closed the idle connection; try a fresh one
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            return _Connection(self._pool, scheme, netloc, conn), response
+
+    def stream(self, url, data=None, headers=(), method=None, *, cache=True):
+        '''
+        return a file-like object with the (decompressed) response body;
+        the body is downloaded and decompressed incrementally, as it is read;
+        unless the response was taken from the cache,
+        the headers attribute of the object holds the response headers
+        cache: whether to use the HTTP cache for this request
+        '''
+        if method is None:
+            method = 'GET' if data is None else 'POST'
+        headers = dict(headers)
+        cache_key = None
+        entry = None
+        if cache and self.cache is not None and method in {'GET', 'POST'}:
+            cache_key = httpcache.make_key(method, url, data)
+            entry = self.cache.get(cache_key)
+        if entry is not None:
+            ttl = self.get_ttl if method == 'GET' else self.post_ttl
+            if self.offline or entry.age < ttl:
+                return entry.file
+            if method == 'GET':
+                if 'etag' in entry.meta:
+                    headers['If-None-Match'] = entry.meta['etag']
+                if 'last-modified' in entry.meta:
+                    headers['If-Modified-Since'] = entry.meta['last-modified']
+        elif self.offline:
+            raise OfflineError(f'not available offline: {url}')
+        try:
+            conn, response = self._open(url, data=data, headers=headers, method=method)
+        except BaseException:
+            if entry is not None:
+                entry.close()
+            raise
+        if response.status == 304 and entry is not None:
+            conn.discard(response)
+            meta = self._get_cache_meta(response, entry.meta)
+            entry = self.cache.refresh(cache_key, entry, meta)
+            return entry.file
+        if entry is not None:
+            entry.close()
+        cache_writer = None
+        if cache_key is not None and 'no-store' not in (response.getheader('Cache-Control') or ''):
+            meta = self._get_cache_meta(response, {})
+            cache_writer = self.cache.writer(cache_key, meta)
+        download = _Download(conn, response, cache_writer)
+        # Responses to HEAD requests, and 204 and 304 responses, have no body,
+        # even if their headers say that it's compressed.
+        has_body = method != 'HEAD' and response.status not in {204, 304}
+        chunks = self._iter_body(download, has_body=has_body)
+        fp = io.BufferedReader(_ChunkReader(chunks, on_close=download.abort), buffer_size=self.chunk_size)
+        fp.headers = response.msg
+        return fp
+
+    def _iter_body(self, download, *, has_body=True):
+        response = download.response
+        cache_writer = download.cache_writer
+        ok = False
+        try:
+            content_encoding = 'identity'
+            if has_body:
+                content_encoding = response.getheader('Content-Encoding', 'identity')
+            if content_encoding == 'gzip':
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif content_encoding == 'identity':
+                decompressor = None
+            else:
+                raise RuntimeError(f'unexpected Content-Encoding: {content_encoding!r}')
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                if cache_writer is not None:
+                    cache_writer.write(chunk)
+                if chunk:
+                    yield chunk
+            if decompressor is not None:
+                chunk = decompressor.flush()
+                if not decompressor.eof:
+                    raise RuntimeError('truncated gzip stream')
+                if cache_writer is not None:
+                    cache_writer.write(chunk)
+                if chunk:
+                    yield chunk
+            ok = True
+        finally:
+            if ok:
+                download.finish()
+            else:
+                download.abort()
+
+    def request(self, url, data=None, headers=(), method=None, *, cache=True):
+        with self.stream(url, data=data, headers=headers, method=method, cache=cache) as fp:
+            return fp.read()
+
+    @staticmethod
+    def _get_cache_meta(response, old_meta):
+        meta = {}
+        for hname in ['ETag', 'Last-Modified']:
+            value = response.getheader(hname) or old_meta.get(hname.lower())
+            if value is not None:
+                meta[hname.lower()] = value
+        return meta
+
+    def _open(self, url, data, headers, method):
         new_headers = dict(self.default_headers)
         new_headers.update(headers)
-        request = urllib.request.Request(url, headers=new_headers, data=data, method=method)
-        with urllib.request.urlopen(request) as fp:
-            content_encoding = fp.getheader('Content-Encoding', 'identity')
-            data = fp.read()
-        if content_encoding == 'gzip':
-            return gzip.decompress(data)
-        elif content_encoding == 'identity':
-            return data
+        for _ in range(self.max_redirects + 1):
+            conn, response = self._send(url, data=data, headers=new_headers, method=method)
+            location = response.getheader('Location')
+            if response.status in {301, 302, 303, 307, 308} and location is not None:
+                conn.discard(response)
+                url = urllib.parse.urljoin(url, location)
+                if response.status in {301, 302, 303} and method != 'HEAD':
+                    method = 'GET'
+                    data = None
+                    new_headers.pop('Content-Length', None)
+                    new_headers.pop('Content-Type', None)
+                continue
+            break
         else:
-            raise RuntimeError(f'unexpected Content-Encoding: {content_encoding!r}')
+            raise RuntimeError(f'too many redirects: {url}')
+        if response.status >= 400:
+            conn.discard(response)
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+        return conn, response
+
+    def get(self, url, headers=(), *, cache=True):
+        return self.request(url, headers=headers, method='GET', cache=cache)
 
-    def get(self, url, headers=()):
-        return self.request(url, headers=headers, method='GET')
+    def head(self, url, headers=()):
+        '''
+        return the response headers
+        '''
+        with self.stream(url, headers=headers, method='HEAD', cache=False) as fp:
+            fp.read()
+            return fp.headers
 
     def post(self, url, data=None, headers=()):
         return self.request(url, data=data, headers=headers, method='POST')
 
-__all__ = ['UserAgent']
+    def get_stream(self, url, headers=(), *, cache=True):
+        return self.stream(url, headers=headers, method='GET', cache=cache)
+
+    def post_stream(self, url, data=None, headers=()):
+        return self.stream(url, data=data, headers=headers, method='POST')
+
+__all__ = [
+    'OfflineError',
+    'UserAgent',
+]
 
 # vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,62 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import io
+import os
+import tempfile
+
+from tests.tools import (
+    assert_equal,
+    assert_false,
+    assert_true,
+    testcase,
+)
+
+from lib.cmd import attachments as M
+
+@testcase
+def test_get_file_name():
+    def t(name, expected):
+        assert_equal(M.get_file_name(42, 3, name), expected)
+    t('build.log', '42-3-build.log')
+    t('../../etc/passwd', '42-3-passwd')
+    t('/etc/passwd', '42-3-passwd')
+    t('foo/', '42-3')
+    t('.bashrc', '42-3-bashrc')
+    t('..', '42-3')
+    t('', '42-3')
+    t(None, '42-3')
+    t('foo\nbar\x7F', '42-3-foo_bar_')
+
+class FakeSession:
+
+    def __init__(self, data):
+        self.data = data
+        self.log = []
+
+    def head(self, url, headers=()):
+        self.log += [('HEAD', url)]
+        return {'Content-Length': str(len(self.data))}
+
+    def get_stream(self, url, headers=(), *, cache=True):
+        self.log += [('GET', url)]
+        return io.BytesIO(self.data)
+
+@testcase
+def test_download():
+    url = 'https://bugs.debian.org/cgi-bin/bugreport.cgi?att=1;bug=42;msg=5'
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        path = os.path.join(tmpdir, '5-1-build.log')
+        session = FakeSession(b'foo')
+        assert_true(M.download(url, path, session=session))
+        assert_false(M.download(url, path, session=session))
+        session.data = b'foobar'
+        assert_true(M.download(url, path, session=session))
+        with open(path, 'rb') as file:
+            assert_equal(file.read(), b'foobar')
+        assert_equal(session.log, [('GET', url), ('HEAD', url), ('HEAD', url), ('GET', url)])
+        assert_equal(os.listdir(tmpdir), ['5-1-build.log'])
+
+del testcase
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,61 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+
+from tests.tools import (
+    TestCase,
+    assert_equal,
+    assert_raises,
+)
+
+from tests.test_debsoap import FakeSession
+
+from lib import bugstore as M
+from lib import debsoap
+
+class test_store(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='dbts-test.')
+        self.store = M.Store(os.path.join(self.tmpdir.name, 'bugs.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        client = debsoap.Client(session=FakeSession({}))
+        bugs = list(client.get_bugs(1, 2, 3, 15))
+        for bug in bugs:
+            self.store.put(bug)
+        query = dict(package='dbts')
+        self.store.set_selection(query, [2, 3])
+        stored_bugs = list(self.store.get_bugs(query, 15))
+        assert_equal(
+            [bug.as_dict() for bug in stored_bugs],
+            [bug.as_dict() for bug in sorted(bugs, key=(lambda bug: bug.id)) if bug.id in {2, 3, 15}]
+        )
+        assert_equal([bug.id for bug in self.store.get_bugs(query, 15, reverse=True)], [15, 3, 2])
+        [bug] = self.store.get_bugs(15)
+        assert_equal(bug.tags, ['patch'])
+        assert_equal(bug.severity, 'serious')
+        assert_equal(self.store.get_last_modified()[15], 1500000015)
+
+    def test_seen(self):
+        client = debsoap.Client(session=FakeSession({}))
+        bug = client.get_status(42)
+        assert_equal(self.store.get_seen(42), None)
+        self.store.set_seen(bug, 10)
+        assert_equal(self.store.get_seen(42), (10, 1500000042))
+        self.store.set_seen(bug, 20)
+        assert_equal(self.store.get_seen(42), (20, 1500000042))
+
+    def test_not_synced(self):
+        with assert_raises(M.NotSyncedError):
+            list(self.store.get_bugs(dict(package='dbts')))
+        with assert_raises(M.NotSyncedError):
+            list(self.store.get_bugs(42))
+
+# vim:ts=4 sts=4 sw=4 et
@@ -111,6 +111,23 @@ def test_escape_safe():
     t('A')
     t('Á')
 
+@testcase
+@with_stdout('UTF-8')
+def test_template():
+    r = M.format('{t.bold}{{{s!r:>5}}}{t.off} {l[1]}', s='x', l=['a', 'b'])
+    assert_equal(r, "\x1B[1m{  'x'}\x1B[0m b")
+
+@testcase
+def test_buffered():
+    stdout = io.StringIO()
+    with unittest.mock.patch('sys.stdout', stdout):
+        with M.buffered():
+            M.print('{s}', s='foo')
+            assert_equal(stdout.getvalue(), '')
+            with M.buffered():
+                M.print('{s}', s='bar')
+    assert_equal(stdout.getvalue(), 'foo\nbar\n')
+
 del testcase
 
 # vim:ts=4 sts=4 sw=4 et
@@ -34,6 +34,10 @@ class test_parse_bugspec(TestCase):
         self.t('85E16', None)
         self.t('6.55941', None)
 
+    def test_msgno(self):
+        self.t('519321#42', None)
+        self.t('https://bugs.debian.org/274135#37', 274135)
+
     def test_short_url(self):
         self.t('http://bugs.debian.org/22282', 22282)
         self.t('https://bugs.debian.org/274135', 274135)
@@ -60,6 +64,36 @@ class test_parse_bugspec(TestCase):
         self.t('https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=1.8943', None)
         self.t('https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=293727;bug=161662', None)
 
+class test_parse_msgspec(TestCase):
+
+    def t(self, s, expected):
+        if expected is None:
+            with assert_raises(ValueError):
+                M.parse_msgspec(s)
+        else:
+            result = M.parse_msgspec(s)
+            assert_equal(result, expected)
+
+    def test_n(self):
+        self.t('155144', (155144, None))
+        self.t('#519321', (519321, None))
+        self.t('519321#42', (519321, 42))
+
+    def test_short_url(self):
+        self.t('https://bugs.debian.org/274135', (274135, None))
+        self.t('https://bugs.debian.org/274135#37', (274135, 37))
+        self.t('https://bugs.debian.org/274135#reply', (274135, None))
+
+    def test_long_url(self):
+        self.t('https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=288454', (288454, None))
+        self.t('https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=288454#10', (288454, 10))
+        self.t('https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=641806;msg=5;mbox=yes', (641806, 5))
+
+    def test_bad_msg(self):
+        self.t('519321#', None)
+        self.t('https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=641806;msg=x', None)
+        self.t('https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=641806;msg=5;msg=6', None)
+
 class test_is_package_name(TestCase):
 
     def t(self, s):
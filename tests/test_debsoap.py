@@ -0,0 +1,379 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import base64
+import concurrent.futures
+import io
+import re
+import threading
+import xml.sax.saxutils as saxutils
+
+from tests.tools import (
+    TestCase,
+    assert_equal,
+    assert_false,
+    assert_true,
+)
+
+from lib import debsoap as M
+from lib import web
+
+_response_template = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope
+  soap:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"
+  xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+  xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/"
+  xmlns:xsi="http://www.w3.org/1999/XMLSchema-instance"
+  xmlns:xsd="http://www.w3.org/1999/XMLSchema"
+><soap:Body><{func}Response xmlns="Debbugs/SOAP">{result}</{func}Response></soap:Body></soap:Envelope>
+'''
+
+def _array(items, tp='xsd:string'):
+    items = (
+        f'<item xsi:type="{tp}">{saxutils.escape(str(item))}</item>'
+        for item in items
+    )
+    return '<soapenc:Array xsi:type="soapenc:Array">' + str.join('', items) + '</soapenc:Array>'
+
+def _versions(name, versions):
+    items = str.join('', (
+        f'<item xsi:type="xsd:string">{v}</item>' if v is not None
+        else '<item xsi:type="xsd:string"/>'
+        for v in versions
+    ))
+    return f'<{name} soapenc:arrayType="xsd:anyType[{len(versions)}]" xsi:type="soapenc:Array">{items}</{name}>'
+
+def _status(n, found=('1.0',), fixed=(), merged_with=(), archived=False):
+    fields = dict(
+        bug_num=n,
+        subject=f'bug {n}',
+        package='dbts' if n % 2 else 'src:dbts',
+        source='dbts',
+        affects='',
+        owner='',
+        originator='Jakub Wilk <jwilk@jwilk.net>',
+        date=1400000000 + n,
+        log_modified=1500000000 + n,
+        last_modified=1500000000 + n,
+        severity='serious' if n % 3 == 0 else 'normal',
+        tags='patch' if n % 5 == 0 else '',
+        mergedwith=str.join(' ', map(str, merged_with)),
+        blockedby='',
+        blocks='',
+        done='',
+        archived=int(archived),
+        forwarded='',
+    )
+    value = str.join('', (
+        f'<{k} xsi:type="xsd:string">{saxutils.escape(str(v))}</{k}>'
+        for k, v in fields.items()
+    ))
+    value += _versions('found_versions', found)
+    value += _versions('fixed_versions', fixed)
+    return f'<item><key xsi:type="xsd:int">{n}</key><value>{value}</value></item>'
+
+def _b64(s):
+    s = base64.b64encode(s.encode('UTF-8')).decode('ASCII')
+    return f'xsi:type="xsd:base64Binary">{s}'
+
+def _message(bugno, n):
+    header = f'From: Jakub Wilk <jwilk@jwilk.net>\nSubject: message {n}\n'
+    body = f'This is message {n} of bug {bugno}.\n'
+    return (
+        '<item>'
+        f'<header {_b64(header)}</header>'
+        f'<msg_num xsi:type="xsd:int">{n}</msg_num>'
+        f'<body {_b64(body)}</body>'
+        '<attachments soapenc:arrayType="xsd:anyType[0]" xsi:type="soapenc:Array"/>'
+        '</item>'
+    )
+
+class FakeSession:
+
+    def __init__(self, bugs, versions=None, merged=None, messages=(5, 10, 15, 20), archived=()):
+        self.bugs = bugs
+        # bug number → (found versions, fixed versions):
+        self.versions = versions or {}
+        # bug number → numbers of merged bugs:
+        self.merged = merged or {}
+        # message numbers of every bug log:
+        self.messages = messages
+        # numbers of archived bugs:
+        self.archived = set(archived)
+        self.log = []
+        self._lock = threading.Lock()
+
+    def post_stream(self, url, data, headers):
+        data = data.decode('UTF-8')
+        [func] = re.findall(r'<ns:(\w+) ', data)
+        args = [saxutils.unescape(v) for v in re.findall(r'<v [^>]+>([^<]*)</v>', data)]
+        with self._lock:
+            self.log += [(func, *args)]
+        if func == 'get_status':
+            result = str.join('', (
+                _status(int(n), *self.versions.get(int(n), ()),
+                    merged_with=self.merged.get(int(n), ()),
+                    archived=(int(n) in self.archived),
+                )
+                for n in args
+            ))
+            result = f'<s-gensym3 xsi:type="apachens:Map">{result}</s-gensym3>'
+        elif func == 'get_bug_log':
+            [bugno] = args
+            result = str.join('', (_message(bugno, n) for n in self.messages))
+            result = f'<soapenc:Array soapenc:arrayType="xsd:anyType[{len(self.messages)}]" xsi:type="soapenc:Array">{result}</soapenc:Array>'
+        elif func == 'get_bugs':
+            query = dict(zip(args[::2], args[1::2]))
+            if set(query) - {'package', 'archive'}:
+                raise NotImplementedError
+            result = _array(self.bugs.get(query['package'], []), tp='xsd:int')
+        elif func == 'newest_bugs':
+            [n] = args
+            bug_numbers = sorted(set().union(*self.bugs.values()))
+            result = _array(bug_numbers[-int(n):], tp='xsd:int')
+        else:
+            raise NotImplementedError
+        response = _response_template.format(func=func, result=result)
+        return io.BytesIO(response.encode('UTF-8'))
+
+class test_batch_sizer(TestCase):
+
+    def test_blocks(self):
+        sizer = M._BatchSizer(10, target_time=2)  # pylint: disable=protected-access
+        assert_equal(sizer.max_level, 3)
+        def blocks(level):
+            result = []
+            start = 0
+            while start < 30:
+                end = sizer.get_end(start, level)
+                result += [end - start]
+                start = end
+            return result
+        assert_equal(blocks(0), [10] * 3)
+        assert_equal(blocks(1), [5] * 6)
+        assert_equal(blocks(2), [2, 3, 2, 3] * 3)
+        assert_equal(blocks(3), [1, 1, 1, 2, 1, 1, 1, 2] * 3)
+        assert_equal(sizer.get_end(5, 0), None)
+        assert_equal(sizer.get_end(15, 1), 20)
+
+    def test_update(self):
+        sizer = M._BatchSizer(500, target_time=2)  # pylint: disable=protected-access
+        assert_equal(sizer.size, 500)
+        sizer.update(500, 5.0, 100000)
+        assert_equal(sizer.size, 125)
+        sizer.update(125, 0.5, 100 << 20)
+        assert_equal(sizer.size, 15)
+        sizer.update(15, 0.01, 1000)
+        assert_equal(sizer.size, 500)
+
+    def test_next_batch(self):
+        sizer = M._BatchSizer(100, target_time=2)  # pylint: disable=protected-access
+        sizer.level = 2
+        assert_equal(sizer.next_batch(0), (25, 2))
+        sizer.level = 0
+        # not aligned with a bigger block yet:
+        assert_equal(sizer.next_batch(25), (50, 2))
+        assert_equal(sizer.next_batch(50), (100, 1))
+        assert_equal(sizer.next_batch(100), (200, 0))
+
+class test_get_status(TestCase):
+
+    def test(self):
+        session = FakeSession({})
+        client = M.Client(session=session)
+        bug = client.get_status(123456)
+        assert_equal(bug.id, 123456)
+        assert_equal(bug.subject, 'bug 123456')
+        assert_equal(bug.severity, 'serious')
+
+    def test_arrays(self):
+        session = FakeSession({}, versions={
+            42: (['1.0', None, 'dbts/1.1'], [None]),
+        })
+        client = M.Client(session=session)
+        bug = client.get_status(42)
+        assert_equal(bug.found_versions, ['1.0', 'dbts/1.1'])
+        assert_equal(bug.fixed_versions, [])
+        bug = client.get_status(43)
+        assert_equal(bug.found_versions, ['1.0'])
+        assert_equal(bug.fixed_versions, [])
+        assert_equal(bug.tags, [])
+        assert_equal(bug.affects, [])
+        bug.tags.append('patch')
+        bug.blocks.append(1)
+        assert_equal(bug.affects, [])
+        assert_equal(bug.merged_with, [])
+        assert_equal(bug.blocked_by, [])
+
+class test_get_log(TestCase):
+
+    def test(self):
+        session = FakeSession({})
+        client = M.Client(session=session)
+        log = client.get_log(123456)
+        assert_equal(len(log), 4)
+        assert_equal([m.id for m in log], [5, 10, 15, 20])
+        message = log[10]
+        assert_equal(message.header['Subject'], 'message 10')
+        assert_equal(message.body, 'This is message 10 of bug 123456.\n')
+        assert_true(message.header is log[10].header)
+        message = log.pop(15)
+        assert_equal(message.id, 15)
+        assert_false(15 in log)
+        assert_equal([m.id for m in log.drain()], [5, 10, 20])
+        assert_equal(len(log), 0)
+
+    def test_lazy(self):
+        session = FakeSession({})
+        client = M.Client(session=session)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            log = client.get_log(123456, lazy=True, executor=executor)
+            try:
+                assert_false(7 in log)
+                assert_equal(log.pop(10).body, 'This is message 10 of bug 123456.\n')
+                assert_equal([m.id for m in log.drain()], [5, 15, 20])
+            finally:
+                log.close()
+
+class test_get_bugs(TestCase):
+
+    def test(self):
+        session = FakeSession(dict(
+            foo=list(range(1000, 1700)),
+            bar=list(range(1500, 2300)),
+        ))
+        client = M.Client(session=session)
+        bugs = list(client.get_bugs(dict(package='foo'), dict(package='bar'), 42))
+        bugs.sort(key=(lambda bug: bug.id))
+        assert_equal(
+            [bug.id for bug in bugs],
+            [42] + list(range(1000, 2300)),
+        )
+        status_calls = {
+            call[1:] for call in session.log
+            if call[0] == 'get_status'
+        }
+        numbers = sorted([42] + list(range(1000, 2300)))
+        assert_equal(
+            status_calls,
+            {
+                tuple(str(n) for n in numbers[i:i + 500])
+                for i in range(0, len(numbers), 500)
+            }
+        )
+        bug = bugs[1]
+        assert_equal(bug.id, 1000)
+        assert_equal(bug.subject, 'bug 1000')
+        assert_equal(bug.package, 'src:dbts')
+        assert_equal(bug.severity, 'normal')
+        assert_equal(bug.tags, ['patch'])
+        assert_equal(bug.found_versions, ['1.0'])
+        assert_equal(bug.fixed_versions, [])
+        assert_equal(bug.merged_with, [])
+        assert_equal(bug.archived, False)
+
+    def test_pipelined(self):
+        session = FakeSession(dict(
+            foo=list(range(1000, 1700)),
+            bar=list(range(1500, 2300)),
+        ))
+        client = M.Client(session=session)
+        bugs = client.get_bugs(dict(package='foo'), dict(package='bar'), 42, 1000, pipelined=True)
+        bug_ids = [bug.id for bug in bugs]
+        assert_equal(
+            sorted(bug_ids),
+            [42] + list(range(1000, 2300)),
+        )
+        for call in session.log:
+            if call[0] == 'get_status':
+                assert_true(len(call) <= 1 + client.batch_size)
+
+    def test_pipelined_idle(self):
+        # bug numbers that are already known are sent
+        # even if a query takes long time
+        released = threading.Event()
+        class SlowSession(FakeSession):
+            def post_stream(self, url, data, headers):
+                if b'get_bugs' in data and not released.wait(timeout=10):
+                    raise RuntimeError('bug #3 was not sent while the query was running')
+                return super().post_stream(url, data, headers)
+        session = SlowSession(dict(foo=[1000]))
+        client = M.Client(session=session, batch_size=2)
+        bug_ids = []
+        for bug in client.get_bugs(1, 2, 3, dict(package='foo'), pipelined=True):
+            bug_ids += [bug.id]
+            if bug.id == 3:
+                assert_false(released.is_set())
+                released.set()
+        released.set()
+        assert_equal(sorted(bug_ids), [1, 2, 3, 1000])
+
+    def test_ordered(self):
+        session = FakeSession(dict(
+            foo=list(range(1000, 1700)),
+            bar=list(range(1500, 2300)),
+        ))
+        client = M.Client(session=session, batch_size=100)
+        bugs = client.get_bugs(dict(package='foo'), dict(package='bar'), 42, ordered=True)
+        bug_ids = [bug.id for bug in bugs]
+        assert_equal(
+            bug_ids,
+            list(range(2299, 999, -1)) + [42],
+        )
+
+    def _get_bugs_shrinking(self):
+        class NetworkSession(FakeSession):
+            def post_stream(self, url, data, headers):
+                fp = super().post_stream(url, data, headers)
+                fp.headers = {}
+                return fp
+        session = NetworkSession(dict(foo=list(range(1000, 1700))))
+        client = M.Client(session=session, max_workers=1, batch_size=100)
+        client._sizer.max_bytes = 10000  # pylint: disable=protected-access
+        bug_ids = [bug.id for bug in client.get_bugs(dict(package='foo'))]
+        assert_equal(sorted(bug_ids), list(range(1000, 1700)))
+        return session.log
+
+    def test_adaptive(self):
+        log = self._get_bugs_shrinking()
+        sizes = [len(call) - 1 for call in log if call[0] == 'get_status']
+        assert_equal(sizes[0], 100)
+        assert_true(max(sizes[1:]) < 100)
+
+    def test_offline(self):
+        # responses cached while batches were shrinking are found again
+        cached = set(self._get_bugs_shrinking())
+        class OfflineSession(FakeSession):
+            def post_stream(self, url, data, headers):
+                fp = super().post_stream(url, data, headers)
+                if self.log[-1] not in cached:
+                    raise web.OfflineError(url)
+                return fp
+        session = OfflineSession(dict(foo=list(range(1000, 1700))))
+        client = M.Client(session=session, batch_size=100)
+        bug_ids = [bug.id for bug in client.get_bugs(dict(package='foo'))]
+        assert_equal(sorted(bug_ids), list(range(1000, 1700)))
+
+    def test_ordered_early_exit(self):
+        session = FakeSession(dict(foo=list(range(1000, 1700))))
+        client = M.Client(session=session, max_workers=1, batch_size=100)
+        bugs = client.get_bugs(dict(package='foo'), ordered=True)
+        try:
+            bug_ids = [bug.id for bug, _ in zip(bugs, range(5))]
+        finally:
+            bugs.close()
+        assert_equal(bug_ids, [1699, 1698, 1697, 1696, 1695])
+        status_calls = [call for call in session.log if call[0] == 'get_status']
+        assert_equal(len(status_calls), 1)
+
+class test_get_bug_numbers(TestCase):
+
+    def test(self):
+        session = FakeSession(dict(foo=[1, 2], bar=[2, 3]))
+        client = M.Client(session=session)
+        numbers = client.get_bug_numbers(dict(package='foo'), dict(package='bar'), 42)
+        assert_equal(numbers, {1, 2, 3, 42})
+        assert_equal({call[0] for call in session.log}, {'get_bugs'})
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,74 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+from tests.tools import (
+    assert_equal,
+    assert_false,
+    assert_raises,
+    testcase,
+)
+
+from lib import dotparser as M
+
+dot_data = r'''digraph G {
+"dbts/1.0" [label="dbts/1.0",fillcolor="salmon",style="filled",shape="box"]
+"dbts/1.1" [label="dbts/1.1",fillcolor="chartreuse",style="filled",shape="box"]
+"dbts/1.2" [label="dbts/1.2",fillcolor="chartreuse",style="filled",shape="box"]
+"some versions" [label="some\nversions",style="filled",shape="box"]
+"dbts/1.1"->"dbts/1.0" [dir="back"]
+"dbts/1.2"->"dbts/1.0" [dir="back"]
+"dbts/1.2"->"some versions" [dir="back"]
+}
+'''
+
+@testcase
+def test_parse():
+    graph = M.parse(dot_data)
+    assert_equal(sorted(graph.nodes), ['dbts/1.0', 'dbts/1.1', 'dbts/1.2', 'some versions'])
+    node = graph.nodes['dbts/1.0']
+    assert_equal(node.get('fillcolor'), 'salmon')
+    assert_equal(node.get('color'), None)
+    assert_equal(str(graph.nodes['some versions']), 'some\nversions')
+    assert_equal(dict(graph.edges), {
+        'dbts/1.0': {'dbts/1.1', 'dbts/1.2'},
+        'some versions': {'dbts/1.2'},
+    })
+
+@testcase
+def test_parse_error():
+    with assert_raises(ValueError):
+        M.parse('digraph G {\n"foo" [label="foo"\n}\n')
+    with assert_raises(ValueError):
+        M.parse('digraph G {\n"foo"->\n}\n')
+    with assert_raises(ValueError):
+        M.parse('graph G {\n}\n')
+
+@testcase
+def test_empty():
+    graph = M.parse('digraph G {\n}\n')
+    assert_false(graph)
+
+@testcase
+def test_pformat():
+    graph = M.parse(dot_data)
+    assert_equal(graph.pformat(bullet='*'),
+        'dbts/1.0\n'
+        '* dbts/1.1\n'
+        '* dbts/1.2\n'
+        'some\n'
+        'versions\n'
+    )
+
+@testcase
+def test_pformat_deep():
+    n = 5000
+    nodes = [M.Node(f'v{i:05}') for i in range(n)]
+    edges = [(f'v{i:05}', f'v{i + 1:05}') for i in range(n - 1)]
+    graph = M.Graph(nodes, edges)
+    lines = graph.pformat(bullet='*').splitlines()
+    assert_equal(len(lines), n)
+    assert_equal(lines[-1], ' ' * (2 * (n - 2)) + f'* v{n - 1:05}')
+
+del testcase
+
+# vim:ts=4 sts=4 sw=4 et
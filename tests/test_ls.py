@@ -0,0 +1,165 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+
+from tests.tools import (
+    assert_equal,
+    assert_raises,
+    testcase,
+)
+from tests.test_debsoap import FakeSession
+
+from lib import debsoap
+from lib.cmd import ls as M
+
+def make_bug(**kwargs):
+    d = dict(
+        id=123456,
+        subject='foo\tbar\nbaz "quoted", with comma',
+        package='dbts',
+        source=None,
+        tags=['patch', 'upstream'],
+        found_versions=[],
+        archived=False,
+        date=1400000000,
+    )
+    d.update(kwargs)
+    return debsoap.BugStatus.from_dict(d)
+
+fields = ['id', 'subject', 'source', 'tags', 'found_versions', 'archived', 'date']
+
+def print_records(fmt, bugs):
+    file = io.StringIO()
+    print_record = M.get_record_printer(fmt, fields, file=file)
+    for bug in bugs:
+        print_record(bug)
+    return file.getvalue()
+
+@testcase
+def test_jsonl():
+    output = print_records('jsonl', [make_bug(), make_bug(id=42, subject='zażółć')])
+    lines = output.splitlines()
+    assert_equal(len(lines), 2)
+    assert_equal(json.loads(lines[0]), dict(
+        id=123456,
+        subject='foo\tbar\nbaz "quoted", with comma',
+        source=None,
+        tags=['patch', 'upstream'],
+        found_versions=[],
+        archived=False,
+        date=1400000000,
+    ))
+    assert_equal(list(json.loads(lines[1])), fields)
+    assert_equal(json.loads(lines[1])['subject'], 'zażółć')
+    assert_equal(lines[1].count('zażółć'), 1)
+
+@testcase
+def test_tsv():
+    output = print_records('tsv', [make_bug()])
+    assert_equal(output, (
+        'id\tsubject\tsource\ttags\tfound_versions\tarchived\tdate\n'
+        '123456\tfoo bar baz "quoted", with comma\t\tpatch upstream\t\t0\t1400000000\n'
+    ))
+
+@testcase
+def test_csv():
+    output = print_records('csv', [make_bug()])
+    assert_equal(output, (
+        'id,subject,source,tags,found_versions,archived,date\n'
+        '123456,"foo\tbar\nbaz ""quoted"", with comma",,patch upstream,,0,1400000000\n'
+    ))
+    rows = list(csv.reader(io.StringIO(output)))
+    assert_equal(rows[1][1], 'foo\tbar\nbaz "quoted", with comma')
+
+@testcase
+def test_bad_format():
+    with assert_raises(ValueError):
+        M.get_record_printer('xml', fields)
+
+@testcase
+def test_parse_fields():
+    assert_equal(M.parse_fields('id,subject'), ['id', 'subject'])
+    with assert_raises(ValueError):
+        M.parse_fields('id,nonexistent')
+    with assert_raises(ValueError):
+        M.parse_fields('')
+
+def parse_args(*args, session=None):
+    ap = argparse.ArgumentParser()
+    M.add_argument_parser(ap.add_subparsers())
+    options = ap.parse_args(['ls', *args])
+    options.jobs = 2
+    options.batch_size = 100
+    options.batch_time = 2.0
+    options.session = session
+    def error(message):
+        raise RuntimeError(message)
+    options.error = error
+    return options
+
+@testcase
+def test_filter():
+    def t(args, bugs, expected, explicit=None):
+        options = parse_args('dbts', *args)
+        predicate = M.get_filter(options, explicit=explicit)
+        if expected is None:
+            assert_equal(predicate, None)
+        else:
+            assert_equal([bug.id for bug in bugs if predicate(bug)], expected)
+    bugs = [
+        make_bug(id=1, severity='serious', tags=['patch'], done=None, archived=False),
+        make_bug(id=2, severity='serious', tags=['patch', 'upstream'], done='Jakub Wilk', archived=True),
+        make_bug(id=3, severity='normal', tags=[], done='Jakub Wilk', archived=False),
+    ]
+    t([], bugs, None)
+    t(['--severity=serious'], bugs, [1, 2])
+    t(['--severity=serious', '--severity=normal'], bugs, [1, 2, 3])
+    t(['--tag=patch', '--tag=upstream'], bugs, [2])
+    t(['--open'], bugs, [1])
+    t(['--done', '--severity=serious'], bugs, [2])
+    t(['--done', '--tag=patch'], bugs, [2])
+    t(['--archived'], bugs, [2])
+    t(['--archived'], bugs, None, explicit=set())
+    t(['--archived'], bugs, [2, 3], explicit={1, 2})
+    t(['--archived', '--done'], bugs, [2, 3], explicit={1, 2})
+
+def run(*args):
+    session = FakeSession(dict(foo=list(range(1000, 1300))), archived=range(1000, 1300, 2))
+    options = parse_args(*args, session=session)
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        M.run(options)
+    return stdout.getvalue(), {call[0] for call in session.log}
+
+@testcase
+def test_count():
+    # only bug numbers are needed:
+    assert_equal(run('--count', 'foo'), ('300\n', {'get_bugs'}))
+    assert_equal(run('--count', '--limit=10', 'foo'), ('10\n', {'get_bugs'}))
+    assert_equal(run('--count', '--archived', 'foo'), ('300\n', {'get_bugs'}))
+    # statuses are needed for filtering:
+    assert_equal(run('--count', '--severity=serious', 'foo'), ('100\n', {'get_bugs', 'get_status'}))
+    assert_equal(run('--count', '--archived', 'foo', '42'), ('300\n', {'get_bugs', 'get_status'}))
+
+@testcase
+def test_limit():
+    (output, calls) = run('--format=tsv', '--fields=id', '--limit=3', 'foo')
+    assert_equal(output, 'id\n1299\n1298\n1297\n')
+    (output, calls) = run('--format=tsv', '--fields=id', '--limit=2', '--tag=patch', 'foo')
+    assert_equal(output, 'id\n1295\n1290\n')
+
+@testcase
+def test_archived_newest():
+    (output, calls) = run('--format=tsv', '--fields=id', 'newest:4')
+    assert_equal(output, 'id\n1299\n1298\n1297\n1296\n')
+    (output, calls) = run('--format=tsv', '--fields=id', '--archived', 'newest:4')
+    assert_equal(output, 'id\n1298\n1296\n')
+
+del testcase
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,249 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import argparse
+import io
+import re
+import threading
+import unittest.mock
+
+from tests.tools import (
+    assert_equal,
+    assert_false,
+    assert_is_instance,
+    testcase,
+)
+from tests.test_debsoap import FakeSession as FakeSOAPSession
+
+from lib.cmd import show as M
+
+mbox_data = b'''\
+From: Jakub Wilk <jwilk@jwilk.net>
+Subject: =?UTF-8?Q?za=C5=BC=C3=B3=C5=82=C4=87?=
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="xyzzy"
+
+--xyzzy
+Content-Type: text/plain; charset=ISO-8859-2
+Content-Transfer-Encoding: quoted-printable
+
+Za=BF=F3=B3=E6 g=EA=B6l=B1 ja=BC=F1.
+
+--xyzzy
+Content-Type: text/plain
+Content-Disposition: attachment; filename="log.txt"
+
+This is an attachment.
+
+--xyzzy--
+'''
+
+class FakeSession:
+
+    def __init__(self):
+        self.log = []
+
+    def get_stream(self, url):
+        self.log += [url]
+        return io.BytesIO(mbox_data)
+
+@testcase
+def test_make_bugreport_url():
+    base_url = 'https://bugs.debian.org/cgi-bin/bugreport.cgi'
+    assert_equal(M.make_bugreport_url(123456), f'{base_url}?bug=123456')
+    assert_equal(M.make_bugreport_url(123456, 42), f'{base_url}?bug=123456;msg=42')
+    assert_equal(M.make_bugreport_url(123456, 42, mbox=True), f'{base_url}?bug=123456;msg=42;mbox=yes')
+    assert_equal(M.make_bugreport_url(123456, mbox=True), f'{base_url}?bug=123456;mbox=yes')
+    assert_equal(M.make_bugreport_url(123456, 0), f'{base_url}?bug=123456;msg=0')
+
+@testcase
+def test_mbox_message():
+    msg = M._MboxMessage(42, io.BytesIO(mbox_data))  # pylint: disable=protected-access
+    assert_equal(msg.id, 42)
+    assert_equal(M.decode_header(msg.header['Subject']), 'zażółć')
+    assert_equal(msg.body, 'Zażółć gęślą jaźń.\n')
+
+@testcase
+def test_mbox_message_no_text():
+    data = b'From: Jakub Wilk <jwilk@jwilk.net>\nContent-Type: image/png\n\nPNG\n'
+    msg = M._MboxMessage(5, io.BytesIO(data))  # pylint: disable=protected-access
+    assert_equal(msg.body, '')
+
+@testcase
+def test_fetch_message():
+    session = FakeSession()
+    msg = M.fetch_message(123456, 42, session=session)
+    assert_equal(session.log, ['https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=123456;msg=42;mbox=yes'])
+    assert_equal(msg.id, 42)
+    assert_equal(msg.body, 'Zażółć gęślą jaźń.\n')
+
+@testcase
+def test_msg_filters():
+    def t(specs, expected, msgs=()):
+        filters = M.get_msg_filters(specs, msgs)
+        assert_equal(list(filters.items()), expected)
+    t([(1, None), (1, 5)], [(1, None)])
+    t([(1, 5), (1, None)], [(1, None)])
+    t([(1, None), (1, None)], [(1, None)])
+    t([(2, 5), (1, None), (2, 7)], [(2, {5, 7}), (1, None)])
+    t([(2, 5), (1, None)], [(2, {5, 9}), (1, {9})], msgs=[9])
+
+html_template = '''<html><body>
+<div class="pkginfo"><a href="pkgreport.cgi?maint=jwilk%40debian.org">Jakub Wilk</a></div>
+<div class="versiongraph"><a href="version.cgi?package=dbts;found=1.0;collapse=1;info=1">graph</a></div>
+{messages}
+</body></html>
+'''
+
+dot_data = b'''digraph G {
+"dbts/1.0" [label="dbts/1.0",fillcolor="salmon",style="filled",shape="box"]
+"dbts/1.1" [label="dbts/1.1",fillcolor="chartreuse",style="filled",shape="box"]
+"dbts/1.1"->"dbts/1.0" [dir="back"]
+}
+'''
+
+class ShowSession(FakeSOAPSession):
+
+    offline = False
+
+    def get_stream(self, url, headers=(), *, cache=True):
+        assert_equal(url.split('?')[0], 'https://bugs.debian.org/cgi-bin/bugreport.cgi')
+        messages = str.join('', (
+            f'<div class="msgreceived"><a name="{n}"></a>Message #{n} received</div>\n'
+            for n in self.messages
+        ))
+        html = html_template.format(messages=messages)
+        return io.BytesIO(html.encode('UTF-8'))
+
+    def get(self, url, headers=(), *, cache=True):
+        assert_equal(url.split('?')[0], 'https://bugs.debian.org/cgi-bin/version.cgi')
+        return dot_data
+
+class Stdout(io.StringIO):
+
+    encoding = 'UTF-8'
+
+    def __init__(self, max_writes=None):
+        super().__init__()
+        self.max_writes = max_writes
+
+    def write(self, s):
+        if self.max_writes is not None:
+            if self.max_writes <= 0:
+                raise BrokenPipeError
+            self.max_writes -= 1
+        return super().write(s)
+
+def run_show(*args, session, jobs=4, stdout=None):
+    '''
+    run "dbts show" in a separate thread, so that a deadlock fails the test;
+    return (output without colors, exception raised by show or None)
+    '''
+    ap = argparse.ArgumentParser()
+    M.add_argument_parser(ap.add_subparsers())
+    options = ap.parse_args(['show', *args])
+    options.jobs = jobs
+    options.cache = False
+    options.session = session
+    def error(message):
+        raise RuntimeError(message)
+    options.error = error
+    if stdout is None:
+        stdout = Stdout()
+    result = {}
+    def target():
+        try:
+            M.run(options)
+        except BaseException as exc:  # pylint: disable=broad-except
+            result['exc'] = exc
+    thread = threading.Thread(target=target, daemon=True)
+    with unittest.mock.patch('sys.stdout', stdout):
+        thread.start()
+        thread.join(timeout=30)
+    assert_false(thread.is_alive(), 'dbts show hung')
+    output = re.sub(r'\x1B\[[0-9;]*m', '', stdout.getvalue())
+    return output, result.get('exc')
+
+def get_locations(output):
+    return re.findall(r'^Location: https://bugs[.]debian[.]org/([0-9#]+)$', output, re.MULTILINE)
+
+expected_output = '''\
+Location: https://bugs.debian.org/1
+Subject: bug 1
+Package: dbts
+Source: dbts
+Maintainer: Jakub Wilk
+Submitter: Jakub Wilk <jwilk@jwilk.net>
+Date: 2014-05-13 16:53:21-00:00
+Severity: normal
+Found:
+  1.0
+Version-Graph:
+  dbts/1.0
+  ∙ dbts/1.1
+{sep}
+Location: https://bugs.debian.org/1#1
+From: Jakub Wilk <jwilk@jwilk.net>
+Subject: message 1
+
+This is message 1 of bug 1.
+{sep}
+Location: https://bugs.debian.org/1#2
+From: Jakub Wilk <jwilk@jwilk.net>
+Subject: message 2
+
+This is message 2 of bug 1.
+{sep}
+
+'''.format(sep=('─' * 80))
+
+@testcase
+def test_run():
+    # the output doesn't depend on the order in which the downloads complete
+    session = ShowSession({}, messages=[1, 2])
+    for jobs in [1, 4]:
+        output, exc = run_show('1', session=session, jobs=jobs)
+        assert_equal(exc, None)
+        assert_equal(output, expected_output)
+
+@testcase
+def test_run_merged():
+    for jobs in [1, 4]:
+        session = ShowSession({}, merged={123: [456], 456: [123]})
+        output, exc = run_show('--merged', '--prefetch=1', '123', '789', session=session, jobs=jobs)
+        assert_equal(exc, None)
+        expected = [
+            loc
+            for bugno in ['123', '456', '789']
+            for loc in [bugno, *(f'{bugno}#{n}' for n in session.messages)]
+        ]
+        assert_equal(get_locations(output), expected)
+        # every status is fetched only once:
+        status_calls = [call for call in session.log if call[0] == 'get_status']
+        assert_equal(sorted(int(n) for call in status_calls for n in call[1:]), [123, 456, 789])
+
+@testcase
+def test_run_broken_pipe():
+    # the log doesn't fit in the background download queue:
+    session = ShowSession({}, messages=range(1, 601))
+    for args in [(), ('--fast',)]:
+        stdout = Stdout(max_writes=50)
+        output, exc = run_show(*args, '1', '2', '3', session=session, stdout=stdout)
+        assert_is_instance(exc, BrokenPipeError)
+
+@testcase
+def test_run_one_job():
+    session = ShowSession({}, messages=range(1, 501))
+    for args in [(), ('--fast',)]:
+        output, exc = run_show(*args, '1', '2', session=session, jobs=1)
+        assert_equal(exc, None)
+        expected = [
+            loc
+            for bugno in ['1', '2']
+            for loc in [bugno, *(f'{bugno}#{n}' for n in session.messages)]
+        ]
+        assert_equal(get_locations(output), expected)
+
+del testcase
+
+# vim:ts=4 sts=4 sw=4 et
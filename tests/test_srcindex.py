@@ -0,0 +1,84 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+
+from tests.tools import (
+    assert_equal,
+    testcase,
+)
+
+from lib import srcindex as M
+
+status_data = '''\
+Package: dbts
+Status: install ok installed
+Version: 1.0
+
+Package: libfoo1
+Status: install ok installed
+Source: foo (1.2-1)
+Version: 1.2-1+b1
+'''
+
+packages_data = '''\
+Package: foo-utils
+Source: foo
+Version: 1.3-1
+
+Package: libfoo1
+Source: foo
+Version: 1.3-1
+
+Package: zzz
+Source: zzz-ng
+Version: 1
+
+Package: zzz
+Version: 2
+'''
+
+def _write(path, data):
+    with open(path, 'wt', encoding='UTF-8') as file:
+        file.write(data)
+
+@testcase
+def test_lookup():
+    with tempfile.TemporaryDirectory(prefix='dbts.test.') as tmpdir:
+        status_path = os.path.join(tmpdir, 'status')
+        packages_path = os.path.join(tmpdir, 'deb.debian.org_debian_dists_sid_main_binary-amd64_Packages')
+        _write(status_path, status_data)
+        _write(packages_path, packages_data)
+        index = M.Index(os.path.join(tmpdir, 'cache', 'srcindex'), inputs=[status_path, packages_path])
+        assert_equal(index.get_sources('dbts'), ['dbts'])
+        assert_equal(index.get_sources('libfoo1'), ['foo'])
+        assert_equal(index.get_sources('foo-utils'), ['foo'])
+        assert_equal(index.get_sources('zzz'), ['zzz', 'zzz-ng'])
+        assert_equal(index.get_sources('foo'), [])
+        assert_equal(index.get_sources('a'), [])
+        assert_equal(index.get_sources('zzzz'), [])
+
+@testcase
+def test_invalidate():
+    with tempfile.TemporaryDirectory(prefix='dbts.test.') as tmpdir:
+        status_path = os.path.join(tmpdir, 'status')
+        _write(status_path, status_data)
+        index_path = os.path.join(tmpdir, 'srcindex')
+        index = M.Index(index_path, inputs=[status_path])
+        assert_equal(index.get_sources('foo-utils'), [])
+        _write(status_path, status_data + '\n' + packages_data)
+        st = os.stat(status_path)
+        os.utime(status_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert_equal(index.get_sources('foo-utils'), ['foo'])
+        index = M.Index(index_path, inputs=[status_path])
+        assert_equal(index.get_sources('foo-utils'), ['foo'])
+
+@testcase
+def test_no_inputs():
+    with tempfile.TemporaryDirectory(prefix='dbts.test.') as tmpdir:
+        index = M.Index(os.path.join(tmpdir, 'srcindex'), inputs=[os.path.join(tmpdir, 'status')])
+        assert_equal(index.get_sources('dbts'), None)
+        assert_equal(os.listdir(tmpdir), [])
+
+# vim:ts=4 sts=4 sw=4 et
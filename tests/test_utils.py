@@ -0,0 +1,71 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import concurrent.futures
+import threading
+
+from tests.tools import (
+    assert_equal,
+    assert_raises,
+    assert_true,
+    testcase,
+)
+
+from lib import utils as M
+
+class _Source:
+
+    def __init__(self, n):
+        self.n = n
+        self.produced = 0
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        for i in range(self.n):
+            self.produced += 1
+            yield i
+
+    def close(self):
+        self.closed.set()
+
+@testcase
+def test_iter_in_background():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        source = _Source(1000)
+        items = M.iter_in_background(executor, source, maxsize=10)
+        assert_equal(list(items), list(range(1000)))
+    assert_true(source.closed.is_set())
+
+@testcase
+def test_iter_in_background_error():
+    def gen():
+        yield 1
+        raise ZeroDivisionError
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        items = M.iter_in_background(executor, gen())
+        assert_equal(next(items), 1)
+        with assert_raises(ZeroDivisionError):
+            next(items)
+
+@testcase
+def test_iter_in_background_close():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        source = _Source(1000)
+        items = M.iter_in_background(executor, source, maxsize=10)
+        # not started yet:
+        items.close()
+        source.closed.wait(timeout=10)
+        assert_true(source.closed.is_set())
+        assert_true(source.produced <= 12)
+        source = _Source(1000)
+        items = M.iter_in_background(executor, source, maxsize=10)
+        assert_equal(next(items), 0)
+        items.close()
+        source.closed.wait(timeout=10)
+        assert_true(source.closed.is_set())
+        assert_true(source.produced <= 13)
+        assert_equal(list(items), [])
+
+del testcase
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,203 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import concurrent.futures
+import gzip
+import os
+import tempfile
+import threading
+import types
+
+from tests.tools import (
+    assert_equal,
+    assert_false,
+    assert_true,
+    testcase,
+)
+
+from lib import httpcache
+from lib import versiongraph as M
+
+dot_data = b'''digraph G {
+"dbts/1.0" [label="dbts/1.0",fillcolor="salmon",style="filled",shape="box"]
+"dbts/1.1" [label="dbts/1.1",fillcolor="chartreuse",style="filled",shape="box"]
+"dbts/1.1"->"dbts/1.0" [dir="back"]
+}
+'''
+
+class FakeSession:
+
+    offline = False
+
+    def __init__(self):
+        self.log = []
+        self._lock = threading.Lock()
+
+    def get(self, url, *, cache=True):
+        assert_false(cache)
+        with self._lock:
+            self.log += [url]
+        return dot_data
+
+@testcase
+def test_canonicalize_url():
+    url1 = M.canonicalize_url(f'{M.base_url}?package=dbts;found=1.1;found=1%3A1.0%2Bdfsg;fixed=2.0;collapse=1;info=1')
+    url2 = M.canonicalize_url(f'{M.base_url}?package=dbts&found=1%3a1.0%2bdfsg&found=1.1&fixed=2.0&collapse=1&info=1')
+    assert_equal(url1, url2)
+    assert_equal(url1, f'{M.base_url}?package=dbts;found=1.1;found=1%3A1.0%2Bdfsg;fixed=2.0;collapse=1;info=1')
+
+@testcase
+def test_make_url():
+    status = types.SimpleNamespace(
+        package='dbts,src:dbts-ng',
+        found_versions=['1.0', 'dbts/1.1+b1'],
+        fixed_versions=['1:2.0-1'],
+    )
+    assert_equal(M.make_url(status), (
+        'https://bugs.debian.org/cgi-bin/version.cgi'
+        '?package=dbts%2Csrc%3Adbts-ng;found=1.0;found=dbts%2F1.1%2Bb1;fixed=1%3A2.0-1;collapse=1;info=1'
+    ))
+    status.found_versions = status.fixed_versions = []
+    assert_equal(M.make_url(status), None)
+
+@testcase
+def test_memory_cache():
+    session = FakeSession()
+    cache = M.Cache(session=session)
+    urls = [
+        f'{M.base_url}?package=dbts;found=1.0;found=1.1;collapse=1;info=1',
+        f'{M.base_url}?package=dbts;found=1.1;found=1.0;collapse=1;info=1',
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        graphs = list(executor.map(cache.get, urls * 4))
+    for graph in graphs:
+        assert_equal(sorted(graph.nodes), ['dbts/1.0', 'dbts/1.1'])
+    assert_equal(session.log, [urls[0] + ';dot=1'])
+    assert_equal(cache.get(None), None)
+
+@testcase
+def test_disk_cache():
+    url = f'{M.base_url}?package=dbts;found=1.0;collapse=1;info=1'
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        session = FakeSession()
+        for i in range(2):
+            cache = M.Cache(session=session, cache=httpcache.Cache(tmpdir))
+            graph = cache.get(url)
+            assert_equal(sorted(graph.nodes), ['dbts/1.0', 'dbts/1.1'])
+        assert_equal(len(session.log), 1)
+
+changelog = '''\
+dbts (1.5) unstable; urgency=medium
+
+  * Fix the bug.
+
+ -- Jakub Wilk <jwilk@jwilk.net>  Fri, 05 Jan 2024 00:00:00 +0100
+
+dbts (1.4) unstable; urgency=medium
+
+  * Frobnicate.
+  * Sprinkle dbts (0.1) unstable for the parser to ignore.
+
+ -- Jakub Wilk <jwilk@jwilk.net>  Thu, 04 Jan 2024 00:00:00 +0100
+
+dbts (1.3) unstable; urgency=low
+
+ -- Jakub Wilk <jwilk@jwilk.net>  Wed, 03 Jan 2024 00:00:00 +0100
+
+dbts (1.2) unstable; urgency=low
+
+ -- Jakub Wilk <jwilk@jwilk.net>  Tue, 02 Jan 2024 00:00:00 +0100
+
+dbts (1.1) unstable; urgency=low
+
+ -- Jakub Wilk <jwilk@jwilk.net>  Mon, 01 Jan 2024 00:00:00 +0100
+
+dbts-old (1.0) unstable; urgency=low
+
+ -- Jakub Wilk <jwilk@jwilk.net>  Sun, 31 Dec 2023 00:00:00 +0100
+'''
+
+def make_tree():
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        path = os.path.join(tmpdir, 'changelog.Debian.gz')
+        with gzip.open(path, 'wt', encoding='UTF-8') as file:
+            file.write(changelog)
+        entries = M.read_changelog(path)
+    assert_equal(entries, [
+        ('dbts', '1.5'),
+        ('dbts', '1.4'),
+        ('dbts', '1.3'),
+        ('dbts', '1.2'),
+        ('dbts', '1.1'),
+        ('dbts-old', '1.0'),
+    ])
+    return M.VersionTree.from_changelog(entries)
+
+@testcase
+def test_is_buggy():
+    tree = make_tree()
+    assert_equal(tree.source, 'dbts')
+    found = ['dbts-old/1.0']
+    fixed = ['1.5']
+    assert_true(tree.is_buggy('1.0', found, fixed))
+    assert_true(tree.is_buggy('dbts/1.3', found, fixed))
+    assert_false(tree.is_buggy('1.5', found, fixed))
+    assert_equal(tree.is_buggy('2.0', found, fixed), None)
+    assert_false(tree.is_buggy('1.1', ['1.2'], []))
+
+@testcase
+def test_make_graph():
+    tree = make_tree()
+    graph = tree.make_graph(['dbts-old/1.0'], ['dbts/1.5'])
+    assert_equal(graph.pformat(bullet='*'),
+        'dbts-old/1.0\n'
+        '* some versions\n'
+        '  * dbts/1.4\n'
+        '    * dbts/1.5\n'
+    )
+    assert_equal(graph.nodes['dbts-old/1.0'].get('fillcolor'), 'salmon')
+    assert_equal(graph.nodes['dbts/1.5'].get('fillcolor'), 'chartreuse')
+    graph = tree.make_graph(['dbts-old/1.0'], ['dbts/1.5'], collapse=False)
+    assert_equal(len(graph.nodes), 6)
+    # older history is left out:
+    graph = tree.make_graph(['1.2'], ['1.4'])
+    assert_equal(graph.pformat(bullet='*'),
+        'dbts/1.2\n'
+        '* dbts/1.3\n'
+        '  * dbts/1.4\n'
+        '    * dbts/1.5\n'
+    )
+
+@testcase
+def test_local_graph():
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        path = os.path.join(tmpdir, 'changelog')
+        with open(path, 'wt', encoding='UTF-8') as file:
+            file.write(changelog)
+        status = types.SimpleNamespace(
+            package='src:dbts', source='dbts',
+            found_versions=['1.1'], fixed_versions=['1.5'],
+        )
+        # the changelog is used only if asked for:
+        session = FakeSession()
+        cache = M.Cache(session=session)
+        cache.get_for_status(status)
+        assert_equal(len(session.log), 1)
+        session = FakeSession()
+        cache = M.Cache(session=session, changelog=path)
+        graph = cache.get_for_status(status)
+        assert_equal(sorted(graph.nodes)[0], 'dbts/1.1')
+        assert_equal(sorted(graph.nodes)[-1], 'dbts/1.5')
+        assert_equal(session.log, [])
+        status.fixed_versions = ['1.6']
+        graph = cache.get_for_status(status)
+        assert_equal(sorted(graph.nodes), ['dbts/1.0', 'dbts/1.1'])
+        assert_equal(len(session.log), 1)
+        status.source = 'dbts-ng'
+        status.fixed_versions = ['1.5']
+        cache.get_for_status(status)
+        assert_equal(len(session.log), 2)
+
+del testcase
+
+# vim:ts=4 sts=4 sw=4 et
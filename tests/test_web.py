@@ -0,0 +1,273 @@
+# Copyright © 2024 Jakub Wilk <jwilk@jwilk.net>
+# SPDX-License-Identifier: MIT
+
+import contextlib
+import gc
+import gzip
+import http.server
+import os
+import socketserver
+import tempfile
+import threading
+import warnings
+
+from tests.tools import (
+    assert_equal,
+    assert_false,
+    assert_raises,
+    testcase,
+)
+
+from lib import httpcache
+from lib import web as M
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body):
+        headers = {}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.log += [self.command + ' ' + self.path]
+        if self.path == '/etag':
+            if self.headers.get('If-None-Match') == '"1"':
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', '"1"')
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            self.wfile.write(b'etag')
+            return
+        if self.path == '/empty':
+            self.send_response(204)
+            self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            return
+        if self.path.startswith('/big/'):
+            n = int(self.path[5:])
+            self._reply(b'x' * n)
+            return
+        self._reply(self.path.encode('ASCII'))
+
+    def do_HEAD(self):
+        self.server.log += [self.command + ' ' + self.path]
+        self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', '42')
+        self.end_headers()
+
+    def do_POST(self):
+        self.server.log += [self.command + ' ' + self.path]
+        n = int(self.headers['Content-Length'])
+        self._reply(self.rfile.read(n))
+
+@contextlib.contextmanager
+def http_server():
+    server = _Server(('127.0.0.1', 0), _Handler)
+    server.log = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        (host, port) = server.server_address
+        yield f'http://{host}:{port}', server.log
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+@testcase
+def test_keep_alive():
+    with http_server() as (base_url, log):
+        ua = M.UserAgent()
+        try:
+            assert_equal(ua.get(base_url + '/foo'), b'/foo')
+            assert_equal(ua.post(base_url + '/', data=b'bar'), b'bar')
+            assert_equal(ua.get(base_url + '/baz?x=1'), b'/baz?x=1')
+        finally:
+            ua.close()
+        assert_equal(ua.stats, dict(opened=1, reused=2))
+
+@testcase
+def test_head():
+    with http_server() as (base_url, log):
+        ua = M.UserAgent()
+        try:
+            assert_equal(ua.head(base_url + '/foo')['Content-Length'], '42')
+            assert_equal(ua.get(base_url + '/foo'), b'/foo')
+        finally:
+            ua.close()
+        assert_equal(log, ['HEAD /foo', 'GET /foo'])
+        assert_equal(ua.stats, dict(opened=1, reused=1))
+
+@testcase
+def test_no_content():
+    with http_server() as (base_url, log):
+        ua = M.UserAgent()
+        try:
+            assert_equal(ua.get(base_url + '/empty'), b'')
+            assert_equal(ua.get(base_url + '/foo'), b'/foo')
+        finally:
+            ua.close()
+        assert_equal(ua.stats, dict(opened=1, reused=1))
+
+@testcase
+def test_stream():
+    n = 1 << 20
+    with http_server() as (base_url, log):
+        ua = M.UserAgent()
+        try:
+            with ua.get_stream(f'{base_url}/big/{n}') as fp:
+                size = 0
+                while True:
+                    chunk = fp.read(1000)
+                    if not chunk:
+                        break
+                    assert_equal(chunk, b'x' * len(chunk))
+                    size += len(chunk)
+            assert_equal(size, n)
+            assert_equal(ua.stats, dict(opened=1, reused=0))
+            # the body was read completely, so the connection can be reused:
+            with ua.get_stream(f'{base_url}/big/{n}') as fp:
+                fp.read(1000)
+            assert_equal(ua.stats, dict(opened=1, reused=1))
+            # the body was not read completely, so the connection was dropped:
+            assert_equal(ua.get(base_url + '/foo'), b'/foo')
+            assert_equal(ua.stats, dict(opened=2, reused=1))
+        finally:
+            ua.close()
+
+@testcase
+def test_cache():
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        cache = httpcache.Cache(tmpdir)
+        with http_server() as (base_url, log):
+            ua = M.UserAgent(cache=cache, post_ttl=300)
+            try:
+                for i in range(2):
+                    assert_equal(ua.get(base_url + '/etag'), b'etag')
+                    assert_equal(ua.post(base_url + '/soap', data=b'foo'), b'foo')
+                assert_equal(ua.post(base_url + '/soap', data=b'bar'), b'bar')
+            finally:
+                ua.close()
+            assert_equal(log, ['GET /etag', 'POST /soap', 'GET /etag', 'POST /soap'])
+        ua = M.UserAgent(cache=cache, offline=True)
+        assert_equal(ua.get(base_url + '/etag'), b'etag')
+        assert_equal(ua.post(base_url + '/soap', data=b'bar'), b'bar')
+        with assert_raises(M.OfflineError):
+            ua.get(base_url + '/nonexistent')
+
+@testcase
+def test_cache_post_default_ttl():
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        cache = httpcache.Cache(tmpdir)
+        with http_server() as (base_url, log):
+            ua = M.UserAgent(cache=cache)
+            try:
+                for i in range(2):
+                    assert_equal(ua.post(base_url + '/soap', data=b'foo'), b'foo')
+            finally:
+                ua.close()
+            assert_equal(log, ['POST /soap', 'POST /soap'])
+        ua = M.UserAgent(cache=cache, offline=True)
+        assert_equal(ua.post(base_url + '/soap', data=b'foo'), b'foo')
+
+@testcase
+def test_no_cache():
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        cache = httpcache.Cache(tmpdir)
+        with http_server() as (base_url, log):
+            ua = M.UserAgent(cache=cache)
+            try:
+                for i in range(2):
+                    with ua.get_stream(base_url + '/big/10', headers={'Accept-Encoding': 'identity'}, cache=False) as fp:
+                        assert_equal(fp.headers['Content-Length'], '10')
+                        assert_equal(fp.read(), b'x' * 10)
+            finally:
+                ua.close()
+            assert_equal(log, ['GET /big/10', 'GET /big/10'])
+        assert_equal(os.listdir(tmpdir), ['.pruned'])
+
+@testcase
+def test_close_unread():
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        cache = httpcache.Cache(tmpdir)
+        with http_server() as (base_url, log):
+            ua = M.UserAgent(cache=cache)
+            try:
+                with warnings.catch_warnings(record=True) as warns:
+                    warnings.simplefilter('always', ResourceWarning)
+                    fp = ua.get_stream(base_url + '/big/10')
+                    fp.close()
+                    del fp
+                    gc.collect()
+                warns = [w for w in warns if issubclass(w.category, ResourceWarning)]
+                assert_equal(warns, [])
+                assert_equal(ua.get(base_url + '/foo'), b'/foo')
+                assert_equal(ua.stats, dict(opened=2, reused=0))
+            finally:
+                ua.close()
+        tmp_files = [
+            name
+            for dirpath, dirnames, filenames in os.walk(tmpdir)
+            for name in filenames
+            if name.startswith('.tmp.')
+        ]
+        assert_equal(tmp_files, [])
+
+@testcase
+def test_cache_prune():
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        cache = httpcache.Cache(tmpdir, max_size=1000)
+        for i, key in enumerate('abc'):
+            cache.put(key, {}, b'x' * 400)
+            path = cache._get_path(key)  # pylint: disable=protected-access
+            os.utime(path, (i, i))
+        cache.get('a').close()
+        cache.prune()
+        assert_equal(cache.get('b'), None)
+        for key in 'ac':
+            with cache.get(key) as entry:
+                assert_equal(entry.body, b'x' * 400)
+        # pruned recently, so the cache is not walked again:
+        cache.put('d', {}, b'x' * 400)
+        cache.prune()
+        with cache.get('a') as entry:
+            assert_equal(entry.body, b'x' * 400)
+        cache.prune(force=True)
+        assert_equal(cache.get('c'), None)
+
+@testcase
+def test_cache_corrupt():
+    with tempfile.TemporaryDirectory(prefix='dbts-test.') as tmpdir:
+        cache = httpcache.Cache(tmpdir)
+        cache.put('a', {}, b'foo')
+        path = cache._get_path('a')  # pylint: disable=protected-access
+        with open(path, 'r+b') as file:
+            file.readline()
+            file.write(b'XXXX')
+        assert_equal(cache.get('a'), None)
+        assert_false(os.path.exists(path))
+
+del testcase
+
+# vim:ts=4 sts=4 sw=4 et